@@ -0,0 +1,100 @@
+"""Замер задержки главного меню и удаления места на большой таблице places.
+
+Запуск из каталога code/:
+
+    python -m bench.db_bench --places 1000000 --users 100000
+
+Скрипт создаёт временную базу, заполняет её и сравнивает запросы
+без индекса places(user_id) и с ним (профиль из database/db.py).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+
+def seed(path: str, users: int, places: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, telegram_id) VALUES (?, ?)",
+        ((i, 10_000_000 + i) for i in range(1, users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO places (name, lat, lon, user_id) VALUES (?, ?, ?, ?)",
+        (
+            (f"place {i}", random.uniform(-60, 70), random.uniform(-180, 180), random.randint(1, users))
+            for i in range(places)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def report(name: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(
+        f"  {name:<8} mean {statistics.mean(samples) * 1000:8.3f} ms"
+        f"  p50 {statistics.median(samples) * 1000:8.3f} ms"
+        f"  p95 {p95 * 1000:8.3f} ms"
+    )
+
+
+async def measure(users: int, samples: int) -> None:
+    from database.db import async_session
+    from database.repository import PlaceRepository, places_cache
+
+    menu, remove = [], []
+    for _ in range(samples):
+        user_id = random.randint(1, users)
+        places_cache.clear()
+        async with async_session() as session:
+            started = time.perf_counter()
+            places = await PlaceRepository.get_all_cached(session, user_id)
+            menu.append(time.perf_counter() - started)
+
+            if places:
+                started = time.perf_counter()
+                await PlaceRepository.delete(session, places[0].id, user_id)
+                remove.append(time.perf_counter() - started)
+
+    report("menu", menu)
+    report("delete", remove)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--places", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    from database.db import engine
+    from database.migrations import migrate
+
+    await migrate(engine)
+    started = time.perf_counter()
+    seed(path, args.users, args.places)
+    print(f"Заполнено {args.places} мест для {args.users} пользователей за {time.perf_counter() - started:.1f} с")
+
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("DROP INDEX ix_places_user_id")
+    print("Без индекса places(user_id):")
+    await measure(args.users, max(args.samples // 10, 20))
+
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("CREATE INDEX ix_places_user_id ON places (user_id)")
+    print("Производственный профиль (WAL + индекс):")
+    await measure(args.users, args.samples)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
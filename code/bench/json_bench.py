@@ -0,0 +1,74 @@
+"""Сравнение JSON-кодеков на записанных ответах OWM forecast.
+
+Запуск из каталога code/:
+
+    python -m bench.json_bench
+
+Для каждого кодека (стандартный json и orjson, если установлен) замеряются
+разбор ответа OWM из байтов, разбор вместе с parse_forecast, сериализация
+прогноза для таблицы forecast_cache и сериализация клавиатуры, как её
+отправляет сессия aiogram.
+"""
+import json
+import time
+import timeit
+from pathlib import Path
+from typing import Any, Callable
+from weather.models import parse_forecast
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def codecs() -> dict[str, tuple[Callable[[bytes], Any], Callable[[Any], str]]]:
+    result = {
+        "json": (json.loads, lambda value: json.dumps(value, ensure_ascii=False, separators=(",", ":"))),
+    }
+    try:
+        import orjson
+    except ImportError:
+        print("orjson не установлен: сравнение только со стандартным json\n")
+    else:
+        result["orjson"] = (orjson.loads, lambda value: orjson.dumps(value).decode())
+    return result
+
+
+def best_time(fn: Callable[[], object], repeat: int = 5) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main() -> None:
+    payloads = [path.read_bytes() for path in sorted(FIXTURES.glob("forecast_*.json"))]
+    # Как в ответе сервера: без отступов
+    payloads = [json.dumps(json.loads(payload), ensure_ascii=False, separators=(",", ":")).encode() for payload in payloads]
+    decoded = [json.loads(payload) for payload in payloads]
+    keyboard = {"inline_keyboard": [
+        [{"text": f"◼ {hour:02d}:00", "callback_data": f"compare_hour_{hour:02d}:00"}] for hour in range(0, 24, 3)
+    ]}
+    fetched_at = time.time()
+
+    operations: dict[str, Callable[[Callable, Callable], Callable[[], object]]] = {
+        "decode_owm": lambda loads, dumps: lambda: [loads(payload) for payload in payloads],
+        "decode_and_parse": lambda loads, dumps: lambda: [parse_forecast(loads(payload), fetched_at) for payload in payloads],
+        "encode_owm": lambda loads, dumps: lambda: [dumps(data) for data in decoded],
+        "encode_keyboard": lambda loads, dumps: lambda: dumps(keyboard),
+    }
+
+    results: dict[str, dict[str, float]] = {}
+    for codec, (loads, dumps) in codecs().items():
+        results[codec] = {name: best_time(build(loads, dumps)) for name, build in operations.items()}
+
+    names = list(results)
+    print(f"{'операция':<20}" + "".join(f"{name + ' мкс':>14}" for name in names) + ("     ускорение" if len(names) > 1 else ""))
+    for operation in operations:
+        times = [results[name][operation] for name in names]
+        line = f"{operation:<20}" + "".join(f"{value * 1e6:>14.1f}" for value in times)
+        if len(times) > 1:
+            line += f"{times[0] / times[1]:>13.1f}×"
+        print(line)
+    print(f"\nОперации decode/encode_owm — {len(payloads)} ответа по {len(decoded[0]['list'])} записей")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""Нагрузочный тест бота с заглушками Telegram Bot API и OpenWeatherMap.
+
+Запуск из каталога code/:
+
+    python -m bench.load_test --users 2000 --concurrency 200
+
+Скрипт поднимает локальные заглушки Bot API и /data/2.5/forecast
+(задержка и доля ошибок настраиваются), временную базу и прогоняет
+через настоящий dp обновления от симулированных пользователей:
+/start, добавление мест, выбор места и прогноз на 5 дней, сравнение
+мест со всеми шагами мастера. Пользователь нажимает кнопки из последнего
+сообщения бота, которое запоминает заглушка Telegram.
+
+Выводит пропускную способность, перцентили задержки обработки обновлений,
+число запросов к заглушкам, ошибки обработчиков и прирост памяти процесса
+(заглушки работают в том же процессе, их состояние невелико).
+По умолчанию лимиты исходящих запросов к Telegram и к OWM сняты,
+чтобы измерять сам бот; --real-limits оставляет значения из config.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any
+from aiohttp import web
+
+FIXTURES = Path(__file__).parent / "fixtures"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "WeatherBot", "username": "weather_bot"}
+
+# Популярные места: несколько десятков точек, которые выбирает большинство пользователей
+CITIES = [
+    (55.7558, 37.6176), (59.9386, 30.3141), (55.0415, 82.9346), (56.8389, 60.6057),
+    (55.7963, 49.1088), (56.3287, 44.002), (54.7431, 55.9678), (53.1959, 50.1002),
+    (47.2357, 39.7015), (45.0448, 38.976), (43.6028, 39.7342), (51.6606, 39.2006),
+]
+
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 2**20
+
+
+# --- Заглушки ---
+
+class StubTelegram:
+    """Bot API: хранит сообщения чатов, чтобы пользователи видели клавиатуры."""
+
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: Counter[str] = Counter()
+        self.errors = 0
+        self.chats: dict[int, dict[int, dict[str, Any]]] = defaultdict(dict)
+        self._ids = itertools.count(1)
+
+    def last_message(self, chat_id: int) -> dict[str, Any] | None:
+        messages = self.chats.get(chat_id)
+        return messages[max(messages)] if messages else None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+        return web.json_response({"ok": True, "result": self._result(method, data)})
+
+    def _result(self, method: str, data: dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if "chat_id" not in data:
+            return True
+        chat_id = int(data["chat_id"])
+        messages = self.chats[chat_id]
+        if method == "sendMessage":
+            message = {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": data["text"],
+            }
+            markup = json.loads(data["reply_markup"]) if "reply_markup" in data else None
+            if markup and "inline_keyboard" in markup:
+                message["reply_markup"] = markup
+            messages[message["message_id"]] = message
+            return message
+        message = messages.get(int(data.get("message_id", 0)))
+        if method == "deleteMessage":
+            messages.pop(int(data["message_id"]), None)
+            return True
+        if method in ("editMessageText", "editMessageReplyMarkup") and message is not None:
+            if "text" in data:
+                message["text"] = data["text"]
+            markup = json.loads(data["reply_markup"]) if "reply_markup" in data else None
+            if markup:
+                message["reply_markup"] = markup
+            else:
+                message.pop("reply_markup", None)
+            return message
+        return True
+
+
+class StubOWM:
+    """/data/2.5/forecast: ответы из bench/fixtures со сдвигом времени к текущему."""
+
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        start = int(time.time()) // 10800 * 10800
+        self.bodies = []
+        for path in sorted(FIXTURES.glob("forecast_*.json")):
+            data = json.loads(path.read_text(encoding="utf-8"))
+            shift = start - data["list"][0]["dt"]
+            for item in data["list"]:
+                item["dt"] += shift
+            self.bodies.append(json.dumps(data, ensure_ascii=False))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=502)
+        body = self.bodies[hash((request.query["lat"], request.query["lon"])) % len(self.bodies)]
+        return web.Response(text=body, content_type="application/json")
+
+
+async def start_stubs(telegram: StubTelegram, owm: StubOWM) -> tuple[web.AppRunner, int]:
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", telegram.handle)
+    app.router.add_get("/data/2.5/forecast", owm.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+# --- Симулированные пользователи ---
+
+class Driver:
+    def __init__(self, bot, dp, telegram: StubTelegram):
+        self.bot = bot
+        self.dp = dp
+        self.telegram = telegram
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self._update_ids = itertools.count(1)
+
+    async def feed(self, kind: str, update: dict[str, Any]) -> None:
+        update["update_id"] = next(self._update_ids)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            self.errors[f"{kind}: {type(e).__name__}"] += 1
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    @staticmethod
+    def _user(user_id: int) -> dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"}
+
+    async def message(self, user_id: int, text: str, kind: str) -> None:
+        message = {
+            "message_id": next(self.telegram._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        await self.feed(kind, {"message": message})
+
+    async def press(self, user_id: int, prefix: str, unselected: bool = False) -> bool:
+        """Нажимает случайную кнопку с callback_data, начинающимся с prefix.
+
+        unselected — только кнопки с отметкой «▢» (ещё не выбранные варианты).
+        """
+        message = self.telegram.last_message(user_id)
+        if message is None:
+            return False
+        buttons = [
+            button["callback_data"]
+            for row in message.get("reply_markup", {}).get("inline_keyboard", [])
+            for button in row
+            if button.get("callback_data", "").startswith(prefix)
+            and not (unselected and button["text"].startswith("◼"))
+        ]
+        if not buttons:
+            return False
+        data = random.choice(buttons)
+        await self.feed(prefix.rstrip("_"), {"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data,
+        }})
+        return True
+
+    async def session(self, user_id: int) -> None:
+        await self.message(user_id, "/start", "start")
+        for number in range(3):
+            lat, lon = random.choice(CITIES)
+            await self.press(user_id, "add_place")
+            await self.message(user_id, f"Место {number}, {lat}, {lon}", "add_place_text")
+
+        await self.press(user_id, "place_")
+        await self.press(user_id, "5days")
+        await self.press(user_id, "main_menu")
+
+        await self.press(user_id, "compare_start")
+        await self.press(user_id, "compare_place_", unselected=True)
+        await self.press(user_id, "compare_place_", unselected=True)
+        await self.press(user_id, "compare_continue")
+        await self.press(user_id, "compare_day_", unselected=True)
+        await self.press(user_id, "compare_day_", unselected=True)
+        await self.press(user_id, "compare_hours")
+        await self.press(user_id, "compare_hour_", unselected=True)
+        await self.press(user_id, "compare_hours_select_all")
+        await self.press(user_id, "compare_execute")
+
+
+def percentile(samples: list[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def report(driver: Driver, telegram: StubTelegram, owm: StubOWM, elapsed: float, rss: tuple[float, float, float]) -> None:
+    samples = sorted(itertools.chain.from_iterable(driver.latencies.values()))
+    print(f"\nОбновлений: {len(samples)} за {elapsed:.1f} с — {len(samples) / elapsed:.0f} в секунду")
+    print(f"{'тип':<26}{'кол-во':>8}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'max мс':>9}")
+    rows = sorted(driver.latencies.items()) + [("всего", samples)]
+    for kind, values in rows:
+        values = sorted(values)
+        print(
+            f"{kind:<26}{len(values):>8}{percentile(values, 0.5) * 1000:>9.1f}"
+            f"{percentile(values, 0.95) * 1000:>9.1f}{percentile(values, 0.99) * 1000:>9.1f}{values[-1] * 1000:>9.1f}"
+        )
+
+    print(f"\nЗапросы к OWM: {owm.calls} (ошибок заглушки: {owm.errors})")
+    print(f"Запросы к Bot API: {sum(telegram.calls.values())} (ошибок заглушки: {telegram.errors})")
+    for method, count in telegram.calls.most_common():
+        print(f"  {method:<24}{count:>8}")
+    if driver.errors:
+        print("\nОшибки обработчиков:")
+        for error, count in driver.errors.most_common():
+            print(f"  {error:<44}{count:>8}")
+    start, end, peak = rss
+    print(f"\nПамять процесса: {start:.0f} → {end:.0f} МиБ (+{end - start:.0f}), пик {peak:.0f} МиБ")
+
+
+async def run(args: argparse.Namespace) -> None:
+    telegram = StubTelegram(args.tg_latency, args.tg_error_rate)
+    owm = StubOWM(args.owm_latency, args.owm_error_rate)
+    runner, port = await start_stubs(telegram, owm)
+
+    workdir = tempfile.mkdtemp(prefix="weatherbot-load-")
+    os.environ.update({
+        "token": "1:load-test",
+        "OWM_API": "load-test",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{port}",
+        "OWM_API_URL": f"http://127.0.0.1:{port}/data/2.5/forecast",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir}/load.db",
+        "PREFETCH_ENABLED": "0",
+        "STATE_BACKEND": "memory",
+        "METRICS_ENABLED": "0",
+        "SLOW_UPDATE_LOG": f"{workdir}/slow_updates.log",
+    })
+    if not args.real_limits:
+        os.environ.update({
+            "OUTBOUND_RATE": "1000000", "OUTBOUND_BURST": "1000000",
+            "OUTBOUND_CHAT_RATE": "1000000", "OUTBOUND_CHAT_BURST": "1000000",
+            "OWM_RATE_PER_MINUTE": "100000000", "OWM_BURST": "1000000", "OWM_DAILY_LIMIT": "100000000",
+        })
+    # main читает окружение при импорте
+    import main as app
+
+    await app.dp.emit_startup(bot=app.bot, dispatcher=app.dp, bots=[app.bot])
+    driver = Driver(app.bot, app.dp, telegram)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    users = range(1_000_000, 1_000_000 + args.users)
+
+    async def user_session(user_id: int) -> None:
+        async with semaphore:
+            await driver.session(user_id)
+
+    rss_start = rss_mib()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(user_session(user_id) for user_id in users))
+        elapsed = time.perf_counter() - started
+    finally:
+        await app.dp.emit_shutdown(bot=app.bot, dispatcher=app.dp, bots=[app.bot])
+        await app.bot.session.close()
+        await runner.cleanup()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report(driver, telegram, owm, elapsed, (rss_start, rss_mib(), peak))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="пользователей одновременно")
+    parser.add_argument("--tg-latency", type=float, default=0.02, help="задержка Bot API, секунды")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0)
+    parser.add_argument("--owm-latency", type=float, default=0.15, help="задержка OWM, секунды")
+    parser.add_argument("--owm-error-rate", type=float, default=0.0)
+    parser.add_argument("--real-limits", action="store_true", help="не снимать лимиты Telegram и OWM")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
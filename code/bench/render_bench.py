@@ -0,0 +1,120 @@
+"""Микробенчмарки разбора и отрисовки прогнозов на записанных ответах OWM.
+
+Запуск из каталога code/:
+
+    python -m bench.render_bench           # замер и сравнение с bench/baseline.json
+    python -m bench.render_bench --save    # замер и запись нового baseline
+
+Для каждой операции выводится время одного вызова (лучшее из повторов)
+и пик выделенной памяти (tracemalloc). Операция, ставшая медленнее
+baseline больше чем на --threshold и при этом больше чем на --min-delta
+микросекунд, считается регрессией: скрипт завершается с кодом 1. Порог в
+микросекундах нужен для быстрых операций (попадание в кэш), у которых
+шум таймера сам по себе больше 20%. Baseline зависит от машины, поэтому его
+стоит записывать там же, где запускается сравнение.
+"""
+import argparse
+import json
+import sys
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+from database.models import PlaceInfo
+from weather import aggregate
+from weather.models import parse_forecast
+from weather.render import get_wind_direction, render_comparison, render_current, render_daily
+from views import render_view
+
+BENCH_DIR = Path(__file__).parent
+FIXTURES = BENCH_DIR / "fixtures"
+BASELINE = BENCH_DIR / "baseline.json"
+
+
+def load_fixtures() -> dict[str, str]:
+    return {path.stem.removeprefix("forecast_"): path.read_text(encoding="utf-8") for path in sorted(FIXTURES.glob("forecast_*.json"))}
+
+
+def build_operations() -> dict[str, Callable[[], object]]:
+    raw = load_fixtures()
+    data = {name: json.loads(body) for name, body in raw.items()}
+    fetched_at = time.time()
+    forecasts = {name: parse_forecast(item, fetched_at) for name, item in data.items()}
+
+    moscow = forecasts["moscow"]
+    places = [PlaceInfo(index, name, 0.0, 0.0) for index, name in enumerate(forecasts)]
+    all_forecasts = list(forecasts.values())
+    days = {entry.date for entry in moscow.entries}
+    hours = {entry.hour for entry in moscow.entries}
+    degrees = [entry.wind_deg for entry in moscow.entries]
+    # Сводки по 300 местам сразу; столбцы прогнозов для numpy строятся при
+    # первом вызове и дальше берутся из Forecast.columns
+    many = all_forecasts * 100
+
+    return {
+        "json_decode": lambda: json.loads(raw["moscow"]),
+        "parse_forecast": lambda: parse_forecast(data["moscow"], fetched_at),
+        "wind_direction_x40": lambda: [get_wind_direction(deg) for deg in degrees],
+        "render_current": lambda: render_current(moscow),
+        "render_today": lambda: render_daily(moscow, 1),
+        "render_5days": lambda: render_daily(moscow, 5),
+        # Повторное нажатие: сообщение берётся из кэша views
+        "render_view_5days_hit": lambda: render_view("g0.02:0:0", "5days", moscow),
+        "render_comparison_3x5d": lambda: render_comparison(places, all_forecasts, days, hours),
+        "daily_summaries_3": lambda: aggregate.daily_summaries(all_forecasts),
+        "daily_summaries_300": lambda: aggregate.daily_summaries(many),
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict[str, float]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    fn()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"us": round(best * 1e6, 3), "peak_kib": round((peak - before) / 1024, 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save", action="store_true", help="записать результаты в baseline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление, доля")
+    parser.add_argument("--min-delta", type=float, default=1.0, help="меньшее замедление не считается, мкс")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() and not args.save else {}
+    results = {}
+    regressions = []
+
+    print(f"Агрегация: {aggregate.ENGINE}\n")
+    print(f"{'операция':<26}{'мкс':>12}{'пик КиБ':>10}{'baseline':>12}{'Δ':>9}")
+    for name, fn in build_operations().items():
+        result = results[name] = measure(fn, args.repeat)
+        line = f"{name:<26}{result['us']:>12.2f}{result['peak_kib']:>10.2f}"
+        if name in baseline:
+            delta = result["us"] / baseline[name]["us"] - 1
+            line += f"{baseline[name]['us']:>12.2f}{delta:>+9.0%}"
+            if delta > args.threshold and result["us"] - baseline[name]["us"] > args.min_delta:
+                regressions.append(name)
+                line += "  ← регрессия"
+        print(line)
+
+    if args.save:
+        args.baseline.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n")
+        print(f"\nBaseline записан в {args.baseline}")
+    elif regressions:
+        print(f"\nЗамедлились больше чем на {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
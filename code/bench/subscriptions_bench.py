@@ -0,0 +1,118 @@
+"""Доставка ежедневных подписок большому числу пользователей.
+
+Запуск из каталога code/:
+
+    python -m bench.subscriptions_bench --subscriptions 100000
+
+Скрипт заполняет временную базу местами вокруг крупных городов
+(разброс --spread градусов) с подпиской на каждое, делает все подписки
+наступившими и прогоняет SubscriptionScheduler.deliver_due через
+настоящий бот с заглушками Bot API и OWM из bench/load_test.py.
+Выводит число запросов к OWM (по одному на ячейку) против числа
+отправленных сообщений и время доставки. Лимиты Telegram и OWM сняты,
+если не указан --real-limits.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from .load_test import CITIES, StubOWM, StubTelegram, start_stubs
+
+
+def seed(path: str, subscriptions: int, spread: float) -> None:
+    from weather.cells import cell_of
+
+    # Подписки на одно время имеют одинаковый next_run, как после next_run_at
+    now = time.time()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (id, telegram_id) VALUES (?, ?)",
+        ((i, 10_000_000 + i) for i in range(1, subscriptions + 1))
+    )
+    places = []
+    for i in range(1, subscriptions + 1):
+        lat, lon = random.choice(CITIES)
+        lat, lon = lat + random.gauss(0, spread), lon + random.gauss(0, spread)
+        places.append((i, f"place {i}", lat, lon, i, cell_of(lat, lon).key))
+    conn.executemany("INSERT INTO places (id, name, lat, lon, user_id, cell) VALUES (?, ?, ?, ?, ?, ?)", places)
+    conn.executemany(
+        "INSERT INTO subscriptions (place_id, user_id, chat_id, minute, kind, next_run) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (i, i, 10_000_000 + i, 8 * 60, random.choice(("today", "5days")), now - random.choice((0, 60, 120)))
+            for i in range(1, subscriptions + 1)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+async def run(args: argparse.Namespace) -> None:
+    telegram = StubTelegram(args.tg_latency, 0.0)
+    owm = StubOWM(args.owm_latency, 0.0)
+    runner, port = await start_stubs(telegram, owm)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="weatherbot-subscriptions-"), "bench.db")
+    os.environ.update({
+        "token": "1:subscriptions-bench",
+        "OWM_API": "subscriptions-bench",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{port}",
+        "OWM_API_URL": f"http://127.0.0.1:{port}/data/2.5/forecast",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{path}",
+        "METRICS_ENABLED": "0",
+    })
+    if not args.real_limits:
+        os.environ.update({
+            "OUTBOUND_RATE": "1000000", "OUTBOUND_BURST": "1000000",
+            "OUTBOUND_CHAT_RATE": "1000000", "OUTBOUND_CHAT_BURST": "1000000",
+            "OWM_RATE_PER_MINUTE": "100000000", "OWM_BURST": "1000000", "OWM_DAILY_LIMIT": "100000000",
+        })
+    # main читает окружение при импорте
+    import main as app
+    from database.db import engine
+    from database.migrations import migrate
+    from weather.client import owm_client
+
+    await migrate(engine)
+    started = time.perf_counter()
+    seed(path, args.subscriptions, args.spread)
+    print(f"Заполнено {args.subscriptions} подписок за {time.perf_counter() - started:.1f} с")
+
+    await owm_client.start()
+    started = time.perf_counter()
+    try:
+        while await app.scheduler.deliver_due(app.bot):
+            pass
+        elapsed = time.perf_counter() - started
+    finally:
+        await owm_client.close()
+        await app.bot.session.close()
+        await runner.cleanup()
+        await engine.dispose()
+
+    from views import rendered_views
+
+    stats = app.scheduler.stats()
+    sent = telegram.calls["sendMessage"]
+    print(f"Доставлено {stats['delivered']} за {elapsed:.1f} с ({stats['delivered'] / elapsed:.0f} сообщений/с), ошибок {stats['failed']}")
+    print(f"Запросов к OWM: {owm.calls} (ячеек {stats['cells']}), текстов отрисовано: {len(rendered_views)}")
+    print(f"sendMessage: {sent}, сообщений на запрос к OWM: {sent / max(owm.calls, 1):.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscriptions", type=int, default=100_000)
+    parser.add_argument("--spread", type=float, default=0.05, help="разброс мест вокруг города, градусы")
+    parser.add_argument("--tg-latency", type=float, default=0.02, help="задержка Bot API, секунды")
+    parser.add_argument("--owm-latency", type=float, default=0.15, help="задержка OWM, секунды")
+    parser.add_argument("--real-limits", action="store_true", help="не снимать лимиты Telegram и OWM")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
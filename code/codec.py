@@ -0,0 +1,38 @@
+# codec.py
+import json
+from typing import Any
+import config
+
+# JSON для ответов OWM, кэша прогнозов, FSM и сессии aiogram.
+# orjson (если установлен) разбирает ответ OWM в несколько раз быстрее
+# стандартного json; JSON_CODEC=json принудительно включает стандартный.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    # orjson не сериализует подклассы tuple (PlaceInfo и другие NamedTuple)
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+if orjson is not None and config.JSON_CODEC != "json":
+    BACKEND = "orjson"
+
+    def loads(data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default).decode()
+else:
+    BACKEND = "json"
+
+    def loads(data: str | bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
@@ -4,4 +4,122 @@ import os
 load_dotenv()
 
 token = os.getenv('token')
-OWM_API = os.getenv('OWM_API')
\ No newline at end of file
+OWM_API = os.getenv('OWM_API')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+# JSON: auto (orjson, если установлен) или json
+JSON_CODEC = os.getenv('JSON_CODEC', 'auto')
+# Агрегация прогнозов: auto (numpy, если установлен) или python
+AGGREGATE_ENGINE = os.getenv('AGGREGATE_ENGINE', 'auto')
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# База данных
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///./weather_bot.db')
+DB_ECHO = os.getenv('DB_ECHO', '0') == '1'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 64 * 1024))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+
+# Кэш прогнозов OpenWeatherMap
+FORECAST_CACHE_TTL = int(os.getenv('FORECAST_CACHE_TTL', 600))
+FORECAST_CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', 10000))
+# Готовые сообщения с прогнозом: по записи на ячейку и вид (current, today, 5days)
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 30000))
+FORECAST_PERSIST = os.getenv('FORECAST_PERSIST', '1') == '1'
+FORECAST_PERSIST_TTL = int(os.getenv('FORECAST_PERSIST_TTL', 6 * 3600))
+FORECAST_SWEEP_INTERVAL = int(os.getenv('FORECAST_SWEEP_INTERVAL', 600))
+# Таблицу forecast_cache пишут и другие процессы (выставляет workers.py)
+FORECAST_SHARED = False
+
+# Ячейки координат: точки одной ячейки получают общий прогноз
+CELL_SCHEME = os.getenv('CELL_SCHEME', 'grid')  # grid или geohash
+CELL_SIZE = float(os.getenv('CELL_SIZE', 0.02))  # шаг сетки grid, градусы
+CELL_GEOHASH_PRECISION = int(os.getenv('CELL_GEOHASH_PRECISION', 5))
+
+# HTTP-клиент OpenWeatherMap
+OWM_API_URL = os.getenv('OWM_API_URL', 'https://api.openweathermap.org/data/2.5/forecast')
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 100))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_DNS_TTL = int(os.getenv('HTTP_DNS_TTL', 300))
+HTTP_KEEPALIVE = float(os.getenv('HTTP_KEEPALIVE', 30))
+
+# Сравнение мест
+COMPARE_CONCURRENCY = int(os.getenv('COMPARE_CONCURRENCY', 6))
+COMPARE_PLACE_TIMEOUT = float(os.getenv('COMPARE_PLACE_TIMEOUT', 8))
+
+# Лимиты тарифа OpenWeatherMap
+OWM_RATE_PER_MINUTE = float(os.getenv('OWM_RATE_PER_MINUTE', 60))
+OWM_BURST = int(os.getenv('OWM_BURST', 10))
+OWM_DAILY_LIMIT = int(os.getenv('OWM_DAILY_LIMIT', 30000))
+OWM_QUEUE_TIMEOUT = float(os.getenv('OWM_QUEUE_TIMEOUT', 5))
+
+# Фоновое обновление прогнозов для популярных мест
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '1') == '1'
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', 60))
+PREFETCH_LEAD = float(os.getenv('PREFETCH_LEAD', 120))
+PREFETCH_PLACES = int(os.getenv('PREFETCH_PLACES', 500))
+PREFETCH_BUDGET = int(os.getenv('PREFETCH_BUDGET', 30))
+PREFETCH_QUOTA_SHARE = float(os.getenv('PREFETCH_QUOTA_SHARE', 0.5))
+
+# Ежедневные подписки на прогноз
+SUBSCRIPTIONS_ENABLED = os.getenv('SUBSCRIPTIONS_ENABLED', '1') == '1'
+SUBSCRIPTION_INTERVAL = float(os.getenv('SUBSCRIPTION_INTERVAL', 30))
+SUBSCRIPTION_BATCH = int(os.getenv('SUBSCRIPTION_BATCH', 5000))
+SUBSCRIPTION_FETCH_CONCURRENCY = int(os.getenv('SUBSCRIPTION_FETCH_CONCURRENCY', 10))
+SUBSCRIPTION_SEND_CONCURRENCY = int(os.getenv('SUBSCRIPTION_SEND_CONCURRENCY', 100))
+# Подписки, опоздавшие сильнее (бот был выключен), ждут следующего дня
+SUBSCRIPTION_MAX_DELAY = float(os.getenv('SUBSCRIPTION_MAX_DELAY', 3 * 3600))
+
+# Кэш идентификаторов и списков мест пользователей
+USER_ID_CACHE_TTL = int(os.getenv('USER_ID_CACHE_TTL', 24 * 3600))
+USER_ID_CACHE_SIZE = int(os.getenv('USER_ID_CACHE_SIZE', 200000))
+PLACES_CACHE_TTL = int(os.getenv('PLACES_CACHE_TTL', 3600))
+PLACES_CACHE_SIZE = int(os.getenv('PLACES_CACHE_SIZE', 50000))
+
+# Состояние диалогов с пользователями
+STATE_TTL = int(os.getenv('STATE_TTL', 24 * 3600))
+STATE_MAX_USERS = int(os.getenv('STATE_MAX_USERS', 100000))
+# Хранилище состояния: memory, sqlite (общая база) или redis
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+STATE_SWEEP_INTERVAL = int(os.getenv('STATE_SWEEP_INTERVAL', 3600))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Исходящие запросы к Telegram: общий темп и темп на чат
+OUTBOUND_RATE = float(os.getenv('OUTBOUND_RATE', 30))
+OUTBOUND_BURST = int(os.getenv('OUTBOUND_BURST', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+# Сообщения старше 48 часов бот всё равно не может редактировать
+OUTBOUND_SENT_TTL = int(os.getenv('OUTBOUND_SENT_TTL', 48 * 3600))
+OUTBOUND_SENT_SIZE = int(os.getenv('OUTBOUND_SENT_SIZE', 100000))
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+
+# Трассировка: обновления дольше SLOW_UPDATE_THRESHOLD секунд записываются
+# в SLOW_UPDATE_LOG деревом span; доля обновлений с профилем cProfile
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '1') == '1'
+SLOW_UPDATE_THRESHOLD = float(os.getenv('SLOW_UPDATE_THRESHOLD', 1.0))
+SLOW_UPDATE_LOG = os.getenv('SLOW_UPDATE_LOG', 'slow_updates.log')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 30))
+
+# Многопроцессный режим (workers.py)
+WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+WORKER_MONITOR_INTERVAL = float(os.getenv('WORKER_MONITOR_INTERVAL', 1))
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', 30))
+# Фоновые задачи (очистка кэша, prefetch) запускает только один процесс
+RUN_BACKGROUND_JOBS = os.getenv('RUN_BACKGROUND_JOBS', '1') == '1'
@@ -0,0 +1,49 @@
+# database/migrations.py
+from typing import Callable
+from sqlalchemy import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+from .models import Base, FSMRecord, Subscription
+
+# Номер схемы хранится в PRAGMA user_version. Первый шаг создаёт все таблицы
+# по текущим моделям, поэтому последующие шаги должны быть идемпотентными:
+# на новой базе их объекты уже существуют.
+
+def _create_schema(conn: Connection) -> None:
+    Base.metadata.create_all(conn)
+
+def _index_places_user_id(conn: Connection) -> None:
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_places_user_id ON places (user_id)")
+
+def _create_fsm_state(conn: Connection) -> None:
+    FSMRecord.__table__.create(conn, checkfirst=True)
+
+def _add_places_cell(conn: Connection) -> None:
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(places)")}
+    if "cell" not in columns:
+        conn.exec_driver_sql("ALTER TABLE places ADD COLUMN cell VARCHAR(32)")
+    # Значения заполняет PlaceRepository.reindex_cells при старте
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_places_cell ON places (cell)")
+
+def _create_subscriptions(conn: Connection) -> None:
+    Subscription.__table__.create(conn, checkfirst=True)
+
+MIGRATIONS: list[tuple[int, Callable[[Connection], None]]] = [
+    (1, _create_schema),
+    (2, _index_places_user_id),
+    (3, _create_fsm_state),
+    (4, _add_places_cell),
+    (5, _create_subscriptions),
+]
+
+def _migrate(conn: Connection) -> int:
+    version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    for number, step in MIGRATIONS:
+        if number > version:
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+            version = number
+    return version
+
+async def migrate(engine: AsyncEngine) -> int:
+    async with engine.begin() as conn:
+        return await conn.run_sync(_migrate)
@@ -1,6 +1,7 @@
 # database/models.py
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey
 from sqlalchemy.orm import declarative_base, relationship
+from typing import NamedTuple
 
 Base = declarative_base()
 
@@ -18,5 +19,54 @@ class Place(Base):
     name = Column(String(50), nullable=False)
     lat = Column(Float, nullable=False)
     lon = Column(Float, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    user = relationship("User", back_populates="places")
\ No newline at end of file
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # Ячейка координат (weather/cells.py); пересчитывается при смене схемы
+    cell = Column(String(32), index=True)
+    user = relationship("User", back_populates="places")
+
+class PlaceInfo(NamedTuple):
+    """Копия места без привязки к сессии SQLAlchemy."""
+    id: int
+    name: str
+    lat: float
+    lon: float
+
+class ForecastCacheEntry(Base):
+    __tablename__ = "forecast_cache"
+    
+    key = Column(String(64), primary_key=True)
+    payload = Column(Text, nullable=False)
+    fetched_at = Column(Float, nullable=False, index=True)
+
+class FSMRecord(Base):
+    __tablename__ = "fsm_state"
+    
+    key = Column(String(128), primary_key=True)
+    state = Column(String(100))
+    data = Column(Text, nullable=False, default="{}")
+    updated_at = Column(Float, nullable=False, index=True)
+
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+    
+    id = Column(Integer, primary_key=True)
+    # Одна подписка на место; при удалении места удаляется вместе с ним
+    place_id = Column(Integer, ForeignKey("places.id"), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    chat_id = Column(Integer, nullable=False)
+    # Время доставки — минуты от полуночи по времени сервера
+    minute = Column(Integer, nullable=False)
+    kind = Column(String(10), nullable=False)  # today или 5days
+    next_run = Column(Float, nullable=False, index=True)
+
+class DueSubscription(NamedTuple):
+    """Подписка к доставке вместе с данными места."""
+    id: int
+    chat_id: int
+    minute: int
+    kind: str
+    next_run: float
+    place_name: str
+    cell: str | None
+    lat: float
+    lon: float
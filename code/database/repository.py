@@ -1,23 +1,72 @@
 # database/repository.py
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, func, update, or_
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from .models import User, Place
+import config
+from cache import TTLCache
+from tracing import traced
+from weather.cells import cell_of, cell_prefix
+from .models import User, Place, PlaceInfo, ForecastCacheEntry, FSMRecord, Subscription, DueSubscription
+
+# telegram_id → users.id: строка пользователя не меняется после создания
+user_ids: TTLCache[int] = TTLCache(
+    ttl=config.USER_ID_CACHE_TTL,
+    maxsize=config.USER_ID_CACHE_SIZE
+)
+
+# Списки мест пользователей для главного меню; сбрасываются при create/delete
+places_cache: TTLCache[tuple[PlaceInfo, ...]] = TTLCache(
+    ttl=config.PLACES_CACHE_TTL,
+    maxsize=config.PLACES_CACHE_SIZE
+)
 
 class UserRepository:
     @staticmethod
+    @traced("db.UserRepository.get_or_create")
     async def get_or_create(session: AsyncSession, telegram_id: int) -> User:
+        user_id = await UserRepository.get_id(session, telegram_id)
+        return await session.get(User, user_id)
+
+    @staticmethod
+    @traced("db.UserRepository.get_id")
+    async def get_id(session: AsyncSession, telegram_id: int) -> int:
+        """Возвращает users.id, при необходимости создавая пользователя."""
+        user_id = user_ids.get(telegram_id)
+        if user_id is not None:
+            return user_id
+
         result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
+            select(User.id).where(User.telegram_id == telegram_id)
         )
-        user = result.scalar_one_or_none()
-        if not user:
-            user = User(telegram_id=telegram_id)
-            session.add(user)
-            await session.commit()
-        return user
+        user_id = result.scalar_one_or_none()
+        if user_id is None:
+            user_id = await UserRepository._upsert(session, telegram_id)
+        user_ids.set(telegram_id, user_id)
+        return user_id
+
+    @staticmethod
+    @traced("db.UserRepository._upsert")
+    async def _upsert(session: AsyncSession, telegram_id: int) -> int:
+        result = await session.execute(
+            insert(User)
+            .values(telegram_id=telegram_id)
+            .on_conflict_do_nothing(index_elements=[User.telegram_id])
+            .returning(User.id)
+        )
+        user_id = result.scalar_one_or_none()
+        if user_id is None:
+            # Пользователя успел создать параллельный запрос
+            await session.rollback()
+            result = await session.execute(
+                select(User.id).where(User.telegram_id == telegram_id)
+            )
+            return result.scalar_one()
+        await session.commit()
+        return user_id
 
 class PlaceRepository:
     @staticmethod
+    @traced("db.PlaceRepository.create")
     async def create(
         session: AsyncSession, 
         user_id: int, 
@@ -25,12 +74,14 @@ class PlaceRepository:
         lat: float, 
         lon: float
     ) -> Place:
-        place = Place(name=name, lat=lat, lon=lon, user_id=user_id)
+        place = Place(name=name, lat=lat, lon=lon, user_id=user_id, cell=cell_of(lat, lon).key)
         session.add(place)
         await session.commit()
+        places_cache.pop(user_id)
         return place
 
     @staticmethod
+    @traced("db.PlaceRepository.get_all")
     async def get_all(session: AsyncSession, user_id: int) -> list[Place]:
         result = await session.execute(
             select(Place).where(Place.user_id == user_id)
@@ -38,19 +89,229 @@ class PlaceRepository:
         return result.scalars().all()
 
     @staticmethod
+    @traced("db.PlaceRepository.get_all_cached")
+    async def get_all_cached(session: AsyncSession, user_id: int) -> tuple[PlaceInfo, ...]:
+        places = places_cache.get(user_id)
+        if places is None:
+            result = await session.execute(
+                select(Place.id, Place.name, Place.lat, Place.lon).where(Place.user_id == user_id)
+            )
+            places = tuple(PlaceInfo(*row) for row in result.all())
+            places_cache.set(user_id, places)
+        return places
+
+    @staticmethod
+    @traced("db.PlaceRepository.get_popular")
+    async def get_popular(session: AsyncSession, limit: int) -> list[tuple[str, int]]:
+        # Ячейки, в которых сохранено больше всего мест
+        result = await session.execute(
+            select(Place.cell, func.count())
+            .where(Place.cell.is_not(None))
+            .group_by(Place.cell)
+            .order_by(func.count().desc())
+            .limit(limit)
+        )
+        return result.all()
+
+    @staticmethod
+    @traced("db.PlaceRepository.reindex_cells")
+    async def reindex_cells(session: AsyncSession, batch: int = 10000) -> int:
+        """Заполняет places.cell там, где он пуст или посчитан для другой схемы ячеек."""
+        prefix = cell_prefix()
+        stale = or_(Place.cell.is_(None), Place.cell.not_like(f"{prefix}%"))
+        updated = 0
+        last_id = 0
+        while True:
+            # Проход по id, чтобы не просматривать уже обновлённые строки заново
+            result = await session.execute(
+                select(Place.id, Place.lat, Place.lon)
+                .where(stale, Place.id > last_id)
+                .order_by(Place.id)
+                .limit(batch)
+            )
+            rows = result.all()
+            if not rows:
+                return updated
+            last_id = rows[-1][0]
+            await session.execute(
+                update(Place),
+                [{"id": place_id, "cell": cell_of(lat, lon).key} for place_id, lat, lon in rows]
+            )
+            await session.commit()
+            updated += len(rows)
+
+    @staticmethod
+    @traced("db.PlaceRepository.delete")
     async def delete(session: AsyncSession, place_id: int, user_id: int) -> bool:
+        await session.execute(
+            delete(Subscription)
+            .where(Subscription.place_id == place_id, Subscription.user_id == user_id)
+        )
         result = await session.execute(
             delete(Place)
             .where(Place.id == place_id, Place.user_id == user_id)
         )
         await session.commit()
+        if result.rowcount > 0:
+            places_cache.pop(user_id)
         return result.rowcount > 0
-    
+
+class ForecastCacheRepository:
+    @staticmethod
+    @traced("db.ForecastCacheRepository.get")
+    async def get(session: AsyncSession, key: str, newer_than: float = 0) -> ForecastCacheEntry | None:
+        result = await session.execute(
+            select(ForecastCacheEntry)
+            .where(ForecastCacheEntry.key == key, ForecastCacheEntry.fetched_at > newer_than)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    @traced("db.ForecastCacheRepository.get_fresh")
+    async def get_fresh(session: AsyncSession, since: float, limit: int) -> list[ForecastCacheEntry]:
+        result = await session.execute(
+            select(ForecastCacheEntry)
+            .where(ForecastCacheEntry.fetched_at >= since)
+            .order_by(ForecastCacheEntry.fetched_at.desc())
+            .limit(limit)
+        )
+        return result.scalars().all()
+
     @staticmethod
+    @traced("db.ForecastCacheRepository.save")
+    async def save(session: AsyncSession, key: str, payload: str, fetched_at: float) -> None:
+        stmt = insert(ForecastCacheEntry).values(key=key, payload=payload, fetched_at=fetched_at)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[ForecastCacheEntry.key],
+                set_={"payload": stmt.excluded.payload, "fetched_at": stmt.excluded.fetched_at}
+            )
+        )
+        await session.commit()
+
+    @staticmethod
+    @traced("db.ForecastCacheRepository.delete_expired")
+    async def delete_expired(session: AsyncSession, before: float) -> int:
+        result = await session.execute(
+            delete(ForecastCacheEntry).where(ForecastCacheEntry.fetched_at < before)
+        )
+        await session.commit()
+        return result.rowcount
+
+class StateRepository:
+    @staticmethod
+    @traced("db.StateRepository.get")
+    async def get(session: AsyncSession, key: str, since: float) -> FSMRecord | None:
+        result = await session.execute(
+            select(FSMRecord).where(FSMRecord.key == key, FSMRecord.updated_at >= since)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    @traced("db.StateRepository.save")
+    async def save(session: AsyncSession, key: str, state: str | None, data: str, updated_at: float) -> None:
+        stmt = insert(FSMRecord).values(key=key, state=state, data=data, updated_at=updated_at)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[FSMRecord.key],
+                set_={"state": stmt.excluded.state, "data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at}
+            )
+        )
+        await session.commit()
+
+    @staticmethod
+    @traced("db.StateRepository.delete")
+    async def delete(session: AsyncSession, key: str) -> None:
+        await session.execute(delete(FSMRecord).where(FSMRecord.key == key))
+        await session.commit()
+
+    @staticmethod
+    @traced("db.StateRepository.delete_expired")
+    async def delete_expired(session: AsyncSession, before: float) -> int:
+        result = await session.execute(
+            delete(FSMRecord).where(FSMRecord.updated_at < before)
+        )
+        await session.commit()
+        return result.rowcount
+
+class SubscriptionRepository:
+    @staticmethod
+    @traced("db.SubscriptionRepository.get")
+    async def get(session: AsyncSession, place_id: int) -> Subscription | None:
+        result = await session.execute(
+            select(Subscription).where(Subscription.place_id == place_id)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    @traced("db.SubscriptionRepository.save")
+    async def save(
+        session: AsyncSession,
+        user_id: int,
+        chat_id: int,
+        place_id: int,
+        minute: int,
+        kind: str,
+        next_run: float
+    ) -> None:
+        stmt = insert(Subscription).values(
+            user_id=user_id, chat_id=chat_id, place_id=place_id, minute=minute, kind=kind, next_run=next_run
+        )
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Subscription.place_id],
+                set_={
+                    "chat_id": stmt.excluded.chat_id,
+                    "minute": stmt.excluded.minute,
+                    "kind": stmt.excluded.kind,
+                    "next_run": stmt.excluded.next_run,
+                }
+            )
+        )
+        await session.commit()
+
+    @staticmethod
+    @traced("db.SubscriptionRepository.delete")
     async def delete(session: AsyncSession, place_id: int, user_id: int) -> bool:
         result = await session.execute(
-            delete(Place)
-            .where(Place.id == place_id, Place.user_id == user_id)
+            delete(Subscription)
+            .where(Subscription.place_id == place_id, Subscription.user_id == user_id)
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+    @staticmethod
+    @traced("db.SubscriptionRepository.delete_for_chats")
+    async def delete_for_chats(session: AsyncSession, chat_ids: list[int]) -> int:
+        # Пользователь заблокировал бота: доставлять больше некуда
+        result = await session.execute(
+            delete(Subscription).where(Subscription.chat_id.in_(chat_ids))
+        )
+        await session.commit()
+        return result.rowcount
+
+    @staticmethod
+    @traced("db.SubscriptionRepository.get_due")
+    async def get_due(session: AsyncSession, now: float, limit: int) -> list[DueSubscription]:
+        result = await session.execute(
+            select(
+                Subscription.id, Subscription.chat_id, Subscription.minute, Subscription.kind,
+                Subscription.next_run, Place.name, Place.cell, Place.lat, Place.lon
+            )
+            .join(Place, Place.id == Subscription.place_id)
+            .where(Subscription.next_run <= now)
+            # У подписок на одно время next_run совпадает: соседние по ячейке
+            # попадают в одну пачку и получают один запрос прогноза
+            .order_by(Subscription.next_run, Place.cell)
+            .limit(limit)
+        )
+        return [DueSubscription(*row) for row in result.all()]
+
+    @staticmethod
+    @traced("db.SubscriptionRepository.reschedule")
+    async def reschedule(session: AsyncSession, runs: list[tuple[int, float]]) -> None:
+        await session.execute(
+            update(Subscription),
+            [{"id": subscription_id, "next_run": next_run} for subscription_id, next_run in runs]
         )
         await session.commit()
-        return result.rowcount > 0
\ No newline at end of file
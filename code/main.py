@@ -1,46 +1,96 @@
+import codec
 import config
-API_KEY = config.OWM_API
 BOT_TOKEN = config.token
 
 import re
-import aiohttp
+import time
+import asyncio
+import logging
 from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ContentType
 from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
-from database.db import engine, async_session, create_tables
-from database.models import Base, Place
-from database.repository import UserRepository, PlaceRepository
-from typing import Dict, List, Set
-from collections import defaultdict
-
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-
-# Глобальные словари для хранения состояния пользователя
-user_coords = {}
-current_actions = {}
-user_last_message = {}
-user_selected_places: Dict[int, List[Place]] = {}
-user_selected_days: Dict[int, Set[datetime.date]] = {}
-user_selected_hours: Dict[int, Set[str]] = {}
-
-def get_wind_direction(deg: float | None) -> str:
-    directions = ["⬇️ С", "↘️ СВ", "➡️ В", "↗️ ЮВ", "⬆️ Ю", "↖️ ЮЗ", "⬅️ З", "↙️ СЗ"]
-    return directions[round(deg / 45) % 8] if deg else "н/д"
-
-def get_day_name(date: datetime.date) -> str:
-    days = ["Понедельник", "Вторник", "Среда", "Четверг", 
-           "Пятница", "Суббота", "Воскресенье"]
-    return days[date.weekday()]
-
+from database.db import engine, async_session
+from database.migrations import migrate
+from database.models import Place, PlaceInfo
+from database.repository import UserRepository, PlaceRepository, SubscriptionRepository, user_ids, places_cache
+from weather.client import owm_client
+from weather.forecast import (
+    forecast_cache, inflight, quota,
+    fetch_forecast, fetch_many, preload_forecasts, sweep_forecasts, flush_persisted, ForecastError
+)
+from weather.prefetch import prefetcher
+from weather.cells import cell_of
+from weather.render import get_day_name, render_comparison
+from weather.quota import QuotaExhausted
+from outbound import outbound
+from subscriptions import scheduler, next_run_at
+from views import RenderedView, render_view, rendered_views
+from state import PlaceForm, SQLiteStorage, TTLMemoryStorage, create_storage
+import metrics
+from tracing import TracingMiddleware, TracingRequestMiddleware, span, traced
+from typing import Set
+
+# TELEGRAM_API_URL — локальный Bot API сервер или заглушка для тестов
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(
+        api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL) if config.TELEGRAM_API_URL else PRODUCTION,
+        json_loads=codec.loads,
+        json_dumps=codec.dumps
+    )
+)
+# Трассировка снаружи outbound: span запроса включает ожидание лимитов
+if config.TRACING_ENABLED:
+    bot.session.middleware(TracingRequestMiddleware())
+# Все запросы к Bot API проходят через лимиты и пропуск пустых правок
+bot.session.middleware(outbound)
+# Состояние пользователей (координаты, выбор для сравнения, последнее сообщение)
+# хранится в FSM-хранилище с вытеснением неактивных пользователей
+dp = Dispatcher(storage=create_storage())
+
+# Метрики: время обработки по типу обновления и статистика кэшей, лимитов и очередей
+dp.update.outer_middleware(metrics.MetricsMiddleware())
+metrics.export_stats("forecast_cache", forecast_cache.stats)
+metrics.export_stats("singleflight", inflight.stats)
+metrics.export_stats("owm_quota", quota.stats)
+metrics.export_stats("outbound", outbound.stats)
+metrics.export_stats("prefetch", prefetcher.stats)
+metrics.export_stats("user_ids_cache", user_ids.stats)
+metrics.export_stats("places_cache", places_cache.stats)
+metrics.export_stats("subscriptions", scheduler.stats)
+metrics.export_stats("rendered_views", rendered_views.stats)
+if isinstance(dp.storage, TTLMemoryStorage):
+    metrics.export_stats("fsm", dp.storage.stats)
+
+# Дерево span медленных обновлений пишется в SLOW_UPDATE_LOG
+if config.TRACING_ENABLED:
+    dp.update.outer_middleware(TracingMiddleware(config.SLOW_UPDATE_THRESHOLD, config.PROFILE_SAMPLE_RATE))
+
+logger = logging.getLogger(__name__)
+
+# Фоновые задачи, запущенные в on_startup
+background_tasks: Set[asyncio.Task] = set()
+
+# Ключи состояния мастера сравнения: compare_places — снимок мест пользователя,
+# compare_mask — битовая маска выбранных из них
+COMPARE_KEYS = ("compare_places", "compare_mask", "compare_days", "compare_hours")
+
+# Подписки: вид прогноза и время доставки (по времени сервера)
+SUBSCRIPTION_KINDS = {"today": "Сегодня", "5days": "5 дней"}
+SUBSCRIPTION_TIMES = ["06:00", "07:00", "08:00", "09:00", "10:00", "12:00", "18:00", "21:00"]
+
+@traced("main.build_main_menu")
 async def build_main_menu(user_id: int) -> InlineKeyboardBuilder:
     builder = InlineKeyboardBuilder()
     async with async_session() as session:
-        user = await UserRepository.get_or_create(session, user_id)
-        places = await PlaceRepository.get_all(session, user.id)
+        owner_id = await UserRepository.get_id(session, user_id)
+        places = await PlaceRepository.get_all_cached(session, owner_id)
         
         for place in places:
             builder.button(
@@ -56,40 +106,78 @@ async def build_main_menu(user_id: int) -> InlineKeyboardBuilder:
     builder.adjust(1, 2, 1, 1)
     return builder
 
-async def edit_or_resend(callback: types.CallbackQuery, text: str, reply_markup: types.InlineKeyboardMarkup = None) -> None:
+@traced("main.edit_or_resend")
+async def edit_or_resend(callback: types.CallbackQuery, state: FSMContext, text: str, reply_markup: types.InlineKeyboardMarkup = None) -> None:
+    # Правка без изменений не считается ошибкой (см. outbound.py): новое
+    # сообщение отправляется, только если старое отредактировать нельзя
     try:
         await callback.message.edit_text(text, reply_markup=reply_markup)
-        user_last_message[callback.from_user.id] = callback.message.message_id
+        await state.update_data(last_message=callback.message.message_id)
     except TelegramBadRequest:
         try:
             await callback.message.delete()
         except TelegramBadRequest:
             pass
         new_msg = await callback.message.answer(text, reply_markup=reply_markup)
-        user_last_message[callback.from_user.id] = new_msg.message_id
+        await state.update_data(last_message=new_msg.message_id)
     finally:
         await callback.answer()
 
-@dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    async with async_session() as session:
-        await UserRepository.get_or_create(session, message.from_user.id)
+@traced("main.delete_last_message")
+async def delete_last_message(message: types.Message, state: FSMContext) -> None:
+    last_message = (await state.get_data()).get("last_message")
+    if last_message is None:
+        return
+    try:
+        await bot.delete_message(message.chat.id, last_message)
+    except TelegramBadRequest:
+        pass
+
+def get_selected_places(data: dict) -> list[PlaceInfo]:
+    mask = data.get("compare_mask", 0)
+    return [
+        PlaceInfo(*place)
+        for index, place in enumerate(data.get("compare_places", []))
+        if mask >> index & 1
+    ]
+
+def build_places_selection(places: list, mask: int) -> types.InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for index, place in enumerate(places):
+        place = PlaceInfo(*place)
+        mark = "◼" if mask >> index & 1 else "▢"
+        builder.button(
+            text=f"{mark} {place.name}", 
+            callback_data=f"compare_place_{place.id}"
+        )
     
+    builder.button(text="✅ Продолжить", callback_data="compare_continue")
+    builder.button(text="❌ Отмена", callback_data="main_menu")
+    builder.adjust(1, 2)
+    return builder.as_markup()
+
+async def reset_comparison(state: FSMContext) -> None:
+    data = await state.get_data()
+    for key in COMPARE_KEYS:
+        data.pop(key, None)
+    await state.set_data(data)
+
+@dp.message(Command("start"))
+async def cmd_start(message: types.Message, state: FSMContext):
+    # build_main_menu сам регистрирует нового пользователя
     builder = await build_main_menu(message.from_user.id)
     msg = await message.answer("🌤 Выберите действие:", reply_markup=builder.as_markup())
-    user_last_message[message.from_user.id] = msg.message_id
+    await state.update_data(last_message=msg.message_id)
 
 @dp.callback_query(F.data == "main_menu")
-async def main_menu(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    user_selected_places.pop(user_id, None)
-    user_selected_days.pop(user_id, None)
-    user_selected_hours.pop(user_id, None)
+async def main_menu(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(None)
+    await reset_comparison(state)
     builder = await build_main_menu(callback.from_user.id)
-    await edit_or_resend(callback, "🌤 Главное меню:", builder.as_markup())
+    await edit_or_resend(callback, state, "🌤 Главное меню:", builder.as_markup())
 
 @dp.callback_query(F.data == "current_location")
-async def request_location(callback: types.CallbackQuery):
+async def request_location(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
     try:
         await callback.message.delete()
@@ -110,17 +198,14 @@ async def request_location(callback: types.CallbackQuery):
         "📍 Отправьте геолокацию или нажмите Отмена:",
         reply_markup=keyboard
     )
-    user_last_message[callback.from_user.id] = msg.message_id
+    await state.update_data(last_message=msg.message_id)
 
 @dp.message(F.text == "❌ Отмена")
-async def cancel_location_request(message: types.Message):
+async def cancel_location_request(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     
     # Удаляем клавиатуру
-    try:
-        await bot.delete_message(message.chat.id, user_last_message[user_id])
-    except TelegramBadRequest:
-        pass
+    await delete_last_message(message, state)
     
     # Удаляем сообщение с кнопкой отмены
     try:
@@ -131,20 +216,15 @@ async def cancel_location_request(message: types.Message):
     # Возвращаем главное меню
     builder = await build_main_menu(user_id)
     msg = await message.answer("🌤 Главное меню:", reply_markup=builder.as_markup())
-    user_last_message[user_id] = msg.message_id
+    await state.update_data(last_message=msg.message_id)
 
 @dp.message(F.content_type == ContentType.LOCATION)
-async def handle_location(message: types.Message):
-    user_id = message.from_user.id
+async def handle_location(message: types.Message, state: FSMContext):
     lat = message.location.latitude
     lon = message.location.longitude
-    user_coords[user_id] = (lat, lon)
+    await state.update_data(coords=(lat, lon))
     
-    if user_id in user_last_message:
-        try:
-            await bot.delete_message(message.chat.id, user_last_message[user_id])
-        except TelegramBadRequest:
-            pass
+    await delete_last_message(message, state)
     
     builder = InlineKeyboardBuilder()
     builder.button(text="Сейчас", callback_data="current")
@@ -154,75 +234,73 @@ async def handle_location(message: types.Message):
     builder.adjust(3)
     
     msg = await message.answer("Выберите тип прогноза:", reply_markup=builder.as_markup())
-    user_last_message[user_id] = msg.message_id
+    await state.update_data(last_message=msg.message_id)
     try:
         await message.delete()
     except TelegramBadRequest:
         pass
 
 @dp.callback_query(F.data == "add_place")
-async def add_place_start(callback: types.CallbackQuery):
-    current_actions[callback.from_user.id] = "adding_place"
+async def add_place_start(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(PlaceForm.adding)
     await edit_or_resend(
         callback,
+        state,
         "Введите данные в формате:\n<Название>, <широта>, <долгота>\nПример: Дом, 55.7558, 37.6176",
         InlineKeyboardBuilder().button(text="← Назад", callback_data="main_menu").as_markup()
     )
 
-@dp.message(F.text)
-async def handle_text(message: types.Message):
+@dp.message(PlaceForm.adding, F.text)
+async def handle_text(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    if current_actions.get(user_id) == "adding_place":
+    try:
+        await delete_last_message(message, state)
+        
+        name, lat, lon = re.split(r"\s*,\s*", message.text, maxsplit=2)
+        lat = float(lat)
+        lon = float(lon)
+        
+        async with async_session() as session:
+            owner_id = await UserRepository.get_id(session, user_id)
+            await PlaceRepository.create(session, owner_id, name, lat, lon)
+            await session.commit()
+        
+        await state.set_state(None)
+        builder = await build_main_menu(user_id)
+        msg = await message.answer(f"✅ Место '{name}' добавлено!", reply_markup=builder.as_markup())
+        await state.update_data(last_message=msg.message_id)
+        
+    except Exception as e:
+        msg = await message.answer(f"❌ Ошибка: {str(e)}")
+        await state.update_data(last_message=msg.message_id)
+    finally:
         try:
-            if user_id in user_last_message:
-                try:
-                    await bot.delete_message(message.chat.id, user_last_message[user_id])
-                except TelegramBadRequest:
-                    pass
-            
-            name, lat, lon = re.split(r"\s*,\s*", message.text, maxsplit=2)
-            lat = float(lat)
-            lon = float(lon)
-            
-            async with async_session() as session:
-                user = await UserRepository.get_or_create(session, user_id)
-                await PlaceRepository.create(session, user.id, name, lat, lon)
-                await session.commit()
-            
-            del current_actions[user_id]
-            builder = await build_main_menu(user_id)
-            msg = await message.answer(f"✅ Место '{name}' добавлено!", reply_markup=builder.as_markup())
-            user_last_message[user_id] = msg.message_id
-            
-        except Exception as e:
-            msg = await message.answer(f"❌ Ошибка: {str(e)}")
-            user_last_message[user_id] = msg.message_id
-        finally:
-            try:
-                await message.delete()
-            except TelegramBadRequest:
-                pass
+            await message.delete()
+        except TelegramBadRequest:
+            pass
 
 @dp.callback_query(F.data.startswith("place_"))
-async def select_place(callback: types.CallbackQuery):
+async def select_place(callback: types.CallbackQuery, state: FSMContext):
     place_id = int(callback.data.split("_")[1])
     
     async with async_session() as session:
-        user = await UserRepository.get_or_create(session, callback.from_user.id)
+        owner_id = await UserRepository.get_id(session, callback.from_user.id)
         place = await session.get(Place, place_id)
         
-        if place and place.user_id == user.id:
-            user_coords[callback.from_user.id] = (place.lat, place.lon)
+        if place and place.user_id == owner_id:
+            await state.update_data(coords=(place.lat, place.lon))
             
             builder = InlineKeyboardBuilder()
             builder.button(text="Сейчас", callback_data="current")
             builder.button(text="Сегодня", callback_data="today")
             builder.button(text="5 дней", callback_data="5days")
+            builder.button(text="🔔 Подписка", callback_data=f"subscribe_{place.id}")
             builder.button(text="← Назад", callback_data="main_menu")
             builder.adjust(3)
             
             await edit_or_resend(
                 callback,
+                state,
                 f"📍 Выбрано: {place.name}",
                 builder.as_markup()
             )
@@ -230,79 +308,54 @@ async def select_place(callback: types.CallbackQuery):
             await callback.answer("🚫 Это не ваше место!", show_alert=True)
 
 @dp.callback_query(F.data == "compare_start")
-async def start_comparison(callback: types.CallbackQuery):
+async def start_comparison(callback: types.CallbackQuery, state: FSMContext):
     async with async_session() as session:
-        user = await UserRepository.get_or_create(session, callback.from_user.id)
-        places = await PlaceRepository.get_all(session, user.id)
+        owner_id = await UserRepository.get_id(session, callback.from_user.id)
+        places = await PlaceRepository.get_all_cached(session, owner_id)
     
     if len(places) < 2:
         await callback.answer("❌ Нужно минимум 2 места для сравнения", show_alert=True)
         return
     
-    builder = InlineKeyboardBuilder()
-    for place in places:
-        builder.button(
-            text=f"▢ {place.name}", 
-            callback_data=f"compare_place_{place.id}"
-        )
-    
-    builder.button(text="✅ Продолжить", callback_data="compare_continue")
-    builder.button(text="❌ Отмена", callback_data="main_menu")
-    builder.adjust(1, 2)
-    
+    # Снимок мест берётся один раз: дальнейшие нажатия не обращаются к базе
+    places = list(places)
     await edit_or_resend(
         callback,
+        state,
         "Выберите места для сравнения (минимум 2):",
-        builder.as_markup()
+        build_places_selection(places, 0)
     )
-    user_selected_places[callback.from_user.id] = []
+    await state.update_data(compare_places=places, compare_mask=0)
 
 @dp.callback_query(F.data.startswith("compare_place_"))
-async def toggle_place_selection(callback: types.CallbackQuery):
+async def toggle_place_selection(callback: types.CallbackQuery, state: FSMContext):
     place_id = int(callback.data.split("_")[-1])
-    user_id = callback.from_user.id
-    
-    async with async_session() as session:
-        place = await session.get(Place, place_id)
-        if not place or place.user_id != (await UserRepository.get_or_create(session, user_id)).id:
-            await callback.answer("❌ Ошибка выбора места")
-            return
-    
-    selected_places = user_selected_places.get(user_id, [])
+    data = await state.get_data()
+    places = data.get("compare_places", [])
     
-    if place in selected_places:
-        selected_places.remove(place)
-        new_text = f"▢ {place.name}"
-    else:
-        selected_places.append(place)
-        new_text = f"◼ {place.name}"
-    
-    keyboard = callback.message.reply_markup.inline_keyboard
-    for row in keyboard:
-        for btn in row:
-            if btn.callback_data == callback.data:
-                btn.text = new_text
+    index = next((i for i, place in enumerate(places) if place[0] == place_id), None)
+    if index is None:
+        await callback.answer("❌ Ошибка выбора места")
+        return
     
-    await callback.message.edit_reply_markup(reply_markup=callback.message.reply_markup)
-    user_selected_places[user_id] = selected_places
+    mask = data.get("compare_mask", 0) ^ (1 << index)
+    await state.update_data(compare_mask=mask)
+    await callback.message.edit_reply_markup(reply_markup=build_places_selection(places, mask))
     await callback.answer()
 
 @dp.callback_query(F.data == "compare_continue")
-async def select_days_for_comparison(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    if len(user_selected_places.get(user_id, [])) < 2:
+async def select_days_for_comparison(callback: types.CallbackQuery, state: FSMContext):
+    selected_places = get_selected_places(await state.get_data())
+    if len(selected_places) < 2:
         await callback.answer("❌ Выберите минимум 2 места", show_alert=True)
         return
 
-    sample_place = user_selected_places[user_id][0]
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={sample_place.lat}&lon={sample_place.lon}&appid={API_KEY}"
+    sample_place = selected_places[0]
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                data = await response.json()
+        forecast = await fetch_forecast(sample_place.lat, sample_place.lon)
         
-        forecast_days = sorted({datetime.fromtimestamp(item['dt']).date() for item in data['list']})
+        forecast_days = sorted({entry.date for entry in forecast.entries})
         max_days = min(len(forecast_days), 5)  # Ограничиваем 5 днями
         
         builder = InlineKeyboardBuilder()
@@ -321,25 +374,25 @@ async def select_days_for_comparison(callback: types.CallbackQuery):
         
         await edit_or_resend(
             callback,
+            state,
             "Выберите дни для сравнения:",
             builder.as_markup()
         )
-        user_selected_days[user_id] = set()
+        await state.update_data(compare_days=[])
         
     except Exception as e:
         await callback.answer("❌ Ошибка получения данных прогноза", show_alert=True)
 
 @dp.callback_query(F.data.startswith("compare_day_"))
-async def toggle_day_selection(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
+async def toggle_day_selection(callback: types.CallbackQuery, state: FSMContext):
     selected_date = datetime.fromisoformat(callback.data.split("_")[-1]).date()
-    current_days = user_selected_days.get(user_id, set())
+    current_days = (await state.get_data()).get("compare_days", [])
     
-    if selected_date in current_days:
-        current_days.remove(selected_date)
+    if selected_date.isoformat() in current_days:
+        current_days.remove(selected_date.isoformat())
         new_text = f"▢ {get_day_name(selected_date)} ({selected_date.strftime('%d.%m')})"
     else:
-        current_days.add(selected_date)
+        current_days.append(selected_date.isoformat())
         new_text = f"◼ {get_day_name(selected_date)} ({selected_date.strftime('%d.%m')})"
     
     keyboard = callback.message.reply_markup.inline_keyboard
@@ -349,18 +402,18 @@ async def toggle_day_selection(callback: types.CallbackQuery):
                 btn.text = new_text
     
     await callback.message.edit_reply_markup(reply_markup=callback.message.reply_markup)
-    user_selected_days[user_id] = current_days
+    await state.update_data(compare_days=current_days)
     await callback.answer()
 
 @dp.callback_query(F.data == "compare_hours")
-async def select_hours_for_comparison(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    if len(user_selected_places.get(user_id, [])) < 2 or len(user_selected_days.get(user_id, set())) == 0:
+async def select_hours_for_comparison(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if len(get_selected_places(data)) < 2 or len(data.get("compare_days", [])) == 0:
         await callback.answer("❌ Выберите минимум 2 места и хотя бы 1 день", show_alert=True)
         return
 
-    default_hours = {"12:00", "15:00", "18:00"}
-    user_selected_hours[user_id] = default_hours.copy()
+    default_hours = ["12:00", "15:00", "18:00"]
+    await state.update_data(compare_hours=default_hours)
     builder = InlineKeyboardBuilder()
     hours_list = ["00:00", "03:00", "06:00", "09:00", "12:00", "15:00", "18:00", "21:00"]
     for hour in hours_list:
@@ -378,21 +431,21 @@ async def select_hours_for_comparison(callback: types.CallbackQuery):
     
     await edit_or_resend(
          callback,
+         state,
          "Выберите время суток для сравнения:\n(Стандартно выбраны 12:00, 15:00, 18:00)",
          builder.as_markup()
     )
 
 @dp.callback_query(F.data.startswith("compare_hour_"))
-async def toggle_hour_selection(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
+async def toggle_hour_selection(callback: types.CallbackQuery, state: FSMContext):
     selected_hour = callback.data.split("_")[-1]
-    current_hours = user_selected_hours.get(user_id, set())
+    current_hours = (await state.get_data()).get("compare_hours", [])
     
     if selected_hour in current_hours:
         current_hours.remove(selected_hour)
         new_text = f"▢ {selected_hour}"
     else:
-        current_hours.add(selected_hour)
+        current_hours.append(selected_hour)
         new_text = f"◼ {selected_hour}"
     
     keyboard = callback.message.reply_markup.inline_keyboard
@@ -402,14 +455,13 @@ async def toggle_hour_selection(callback: types.CallbackQuery):
                 btn.text = new_text
     
     await callback.message.edit_reply_markup(reply_markup=callback.message.reply_markup)
-    user_selected_hours[user_id] = current_hours
+    await state.update_data(compare_hours=current_hours)
     await callback.answer()
 
 @dp.callback_query(F.data == "compare_hours_select_all")
-async def select_all_hours(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    hours_list = {"00:00", "03:00", "06:00", "09:00", "12:00", "15:00", "18:00", "21:00"}
-    user_selected_hours[user_id] = hours_list.copy()
+async def select_all_hours(callback: types.CallbackQuery, state: FSMContext):
+    hours_list = ["00:00", "03:00", "06:00", "09:00", "12:00", "15:00", "18:00", "21:00"]
+    await state.update_data(compare_hours=hours_list)
     keyboard = callback.message.reply_markup.inline_keyboard
     for row in keyboard:
         for btn in row:
@@ -420,9 +472,8 @@ async def select_all_hours(callback: types.CallbackQuery):
     await callback.answer("Все часы выбраны")
 
 @dp.callback_query(F.data == "compare_hours_deselect_all")
-async def deselect_all_hours(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    user_selected_hours[user_id] = set()
+async def deselect_all_hours(callback: types.CallbackQuery, state: FSMContext):
+    await state.update_data(compare_hours=[])
     keyboard = callback.message.reply_markup.inline_keyboard
     for row in keyboard:
         for btn in row:
@@ -433,11 +484,11 @@ async def deselect_all_hours(callback: types.CallbackQuery):
     await callback.answer("Все часы сняты")
 
 @dp.callback_query(F.data == "compare_execute")
-async def execute_comparison(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    places = user_selected_places.get(user_id, [])
-    days = user_selected_days.get(user_id, set())
-    selected_hours = user_selected_hours.get(user_id, set())
+async def execute_comparison(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    places = get_selected_places(data)
+    days = {datetime.fromisoformat(day).date() for day in data.get("compare_days", [])}
+    selected_hours = set(data.get("compare_hours", []))
     
     if len(places) < 2 or len(days) == 0:
         await callback.answer("❌ Выберите минимум 2 места и хотя бы 1 день", show_alert=True)
@@ -446,55 +497,28 @@ async def execute_comparison(callback: types.CallbackQuery):
         await callback.answer("❌ Выберите хотя бы один час", show_alert=True)
         return
 
-    all_data = defaultdict(dict)
-    
-    for place in places:
-        url = f"https://api.openweathermap.org/data/2.5/forecast?lat={place.lat}&lon={place.lon}&appid={API_KEY}&units=metric&lang=ru"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    data = await response.json()
-            
-            for item in data['list']:
-                date = datetime.fromtimestamp(item['dt']).date()
-                time_str = datetime.fromtimestamp(item['dt']).strftime("%H:%M")
-                if date in days and time_str in selected_hours:
-                    all_data[date].setdefault(time_str, {})
-                    all_data[date][time_str][place.name] = {
-                        'temp': item['main']['temp'],
-                        'humidity': item['main']['humidity'],
-                        'wind_speed': item['wind']['speed'],
-                        'description': item['weather'][0]['description'].capitalize()
-                    }
-        
-        except Exception as e:
-            await callback.answer(f"❌ Ошибка получения данных для {place.name}", show_alert=True)
-            return
+    # Запрашиваем все места одновременно: время сравнения ≈ самый медленный запрос
+    forecasts = await fetch_many([(place.lat, place.lon) for place in places])
+
+    for place, forecast in zip(places, forecasts):
+        if isinstance(forecast, BaseException):
+            logger.warning("Нет прогноза для сравнения, место %s: %r", place.name, forecast)
+
+    if all(isinstance(forecast, BaseException) for forecast in forecasts):
+        await callback.answer("❌ Ошибка получения данных прогноза", show_alert=True)
+        return
+
+    with span("render.comparison"):
+        text = render_comparison(places, forecasts, days, selected_hours)
 
-    result = []
-    for date in sorted(days):
-        result.append(f"📅 {get_day_name(date)} ({date.strftime('%d.%m')}):")
-        
-        for time in sorted(all_data[date].keys()):
-            result.append(f"\n⏰ {time}:")
-            
-            for place_name, weather in all_data[date][time].items():
-                result.append(
-                    f"  🌍 {place_name}:\n"
-                    f"    🌡 {weather['temp']}°C | 💧 {weather['humidity']}%\n"
-                    f"    🌪 {weather['wind_speed']} м/с | ☁️ {weather['description']}"
-                )
-        
-        result.append("\n" + "─"*30)
-    
     builder = InlineKeyboardBuilder()
     builder.button(text="← Назад в меню", callback_data="main_menu")
     
     try:
         await edit_or_resend(
             callback,
-            "\n".join(result)[:4000],  # Ограничение Telegram на длину сообщения
+            state,
+            text[:4000],  # Ограничение Telegram на длину сообщения
             builder.as_markup()
         )
     except TelegramBadRequest:
@@ -504,15 +528,13 @@ async def execute_comparison(callback: types.CallbackQuery):
         )
     
     # Очищаем состояние
-    user_selected_places.pop(user_id, None)
-    user_selected_days.pop(user_id, None)
-    user_selected_hours.pop(user_id, None)
+    await reset_comparison(state)
 
 @dp.callback_query(F.data == "delete_place")
-async def delete_place_start(callback: types.CallbackQuery):
+async def delete_place_start(callback: types.CallbackQuery, state: FSMContext):
     async with async_session() as session:
-        user = await UserRepository.get_or_create(session, callback.from_user.id)
-        places = await PlaceRepository.get_all(session, user.id)
+        owner_id = await UserRepository.get_id(session, callback.from_user.id)
+        places = await PlaceRepository.get_all_cached(session, owner_id)
     
     if not places:
         await callback.answer("❌ У вас нет сохраненных мест", show_alert=True)
@@ -526,12 +548,13 @@ async def delete_place_start(callback: types.CallbackQuery):
     
     await edit_or_resend(
         callback,
+        state,
         "Выберите место для удаления:",
         builder.as_markup()
     )
 
 @dp.callback_query(F.data.startswith("delete_confirm_"))
-async def delete_place_confirm(callback: types.CallbackQuery):
+async def delete_place_confirm(callback: types.CallbackQuery, state: FSMContext):
     place_id = int(callback.data.split("_")[-1])
     
     builder = InlineKeyboardBuilder()
@@ -541,148 +564,210 @@ async def delete_place_confirm(callback: types.CallbackQuery):
     
     await edit_or_resend(
         callback,
+        state,
         "Вы уверены, что хотите удалить это место?",
         builder.as_markup()
     )
 
 @dp.callback_query(F.data.startswith("delete_final_"))
-async def delete_place_final(callback: types.CallbackQuery):
+async def delete_place_final(callback: types.CallbackQuery, state: FSMContext):
     place_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
     
     async with async_session() as session:
-        user = await UserRepository.get_or_create(session, user_id)
-        success = await PlaceRepository.delete(session, place_id, user.id)
+        owner_id = await UserRepository.get_id(session, user_id)
+        success = await PlaceRepository.delete(session, place_id, owner_id)
     
     if success:
         builder = await build_main_menu(user_id)
         await edit_or_resend(
             callback,
+            state,
             "✅ Место успешно удалено!",
             builder.as_markup()
         )
     else:
         await edit_or_resend(
             callback,
+            state,
             "❌ Не удалось удалить место",
             InlineKeyboardBuilder().button(text="← Назад", callback_data="main_menu").as_markup()
         )
 
-@dp.callback_query(F.data.in_(["current", "today", "5days"]))
-async def process_forecast(callback: types.CallbackQuery):
-    user_id = callback.from_user.id
-    if user_id not in user_coords:
-        await callback.answer("❌ Сначала выберите местоположение!", show_alert=True)
-        return
+async def get_own_place(session, telegram_id: int, place_id: int) -> tuple[int, Place | None]:
+    owner_id = await UserRepository.get_id(session, telegram_id)
+    place = await session.get(Place, place_id)
+    return owner_id, place if place and place.user_id == owner_id else None
 
-    lat, lon = user_coords[user_id]
-    
-    try:
-        url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={API_KEY}&units=metric&lang=ru"
-        
-        async with aiohttp.ClientSession() as http_session:
-            async with http_session.get(url) as response:
-                if response.status != 200:
-                    await callback.answer("⛈ Ошибка сервера. Попробуйте позже.", show_alert=True)
-                    return
-                
-                forecast_data = await response.json()
-                
-                if callback.data == "current":
-                    await send_current_weather(forecast_data, callback)
-                elif callback.data == "today":
-                    await send_daily_forecast(forecast_data, 1, callback)
-                elif callback.data == "5days":
-                    await send_daily_forecast(forecast_data, 5, callback)
+@dp.callback_query(F.data.startswith("subscribe_"))
+async def subscription_menu(callback: types.CallbackQuery, state: FSMContext):
+    place_id = int(callback.data.split("_")[-1])
 
-    except Exception as e:
-        print(f"Error: {e}")
-        await callback.answer("⛈ Ошибка запроса. Попробуйте позже.", show_alert=True)
+    async with async_session() as session:
+        _, place = await get_own_place(session, callback.from_user.id, place_id)
+        if place is None:
+            await callback.answer("🚫 Это не ваше место!", show_alert=True)
+            return
+        subscription = await SubscriptionRepository.get(session, place_id)
 
-async def send_current_weather(data: dict, callback: types.CallbackQuery):
-    if not data.get("list") or len(data["list"]) == 0:
-        await callback.answer("❌ Нет данных о текущей погоде.", show_alert=True)
+    builder = InlineKeyboardBuilder()
+    for kind, title in SUBSCRIPTION_KINDS.items():
+        builder.button(text=title, callback_data=f"sub_kind_{kind}_{place_id}")
+    if subscription:
+        hour, minute = divmod(subscription.minute, 60)
+        status = f"Сейчас: «{SUBSCRIPTION_KINDS[subscription.kind]}» каждый день в {hour:02d}:{minute:02d}"
+        builder.button(text="🔕 Отписаться", callback_data=f"unsubscribe_{place_id}")
+    else:
+        status = "Подписки пока нет"
+    builder.button(text="← Назад", callback_data=f"place_{place_id}")
+    builder.adjust(2, 1, 1)
+
+    await edit_or_resend(
+        callback,
+        state,
+        f"🔔 Ежедневный прогноз для {place.name}\n{status}\n\nВыберите вид прогноза:",
+        builder.as_markup()
+    )
+
+@dp.callback_query(F.data.startswith("sub_kind_"))
+async def subscription_time(callback: types.CallbackQuery, state: FSMContext):
+    _, _, kind, place_id = callback.data.split("_")
+    if kind not in SUBSCRIPTION_KINDS:
+        await callback.answer()
         return
 
-    current = data["list"][0]
-    temp = current["main"].get("temp", "н/д")
-    humidity = current["main"].get("humidity", "н/д")
-    desc = current["weather"][0].get("description", "н/д").capitalize()
-    wind_speed = current["wind"].get("speed", "н/д")
-    wind_deg = current["wind"].get("deg")
-    
     builder = InlineKeyboardBuilder()
-    builder.button(text="← Назад", callback_data="main_menu")
-    
+    for hour in SUBSCRIPTION_TIMES:
+        builder.button(text=hour, callback_data=f"sub_time_{kind}_{place_id}_{hour}")
+    builder.button(text="← Назад", callback_data=f"subscribe_{place_id}")
+    builder.adjust(4, 4, 1)
+
     await edit_or_resend(
         callback,
-        f"🌡 Сейчас: {temp}°C\n"
-        f"💧 Влажность: {humidity}%\n"
-        f"🌪 Ветер: {wind_speed} м/с ({get_wind_direction(wind_deg)})\n"
-        f"☁️ {desc}",
+        state,
+        f"Во сколько присылать прогноз «{SUBSCRIPTION_KINDS[kind]}»?\nСейчас по часам бота {datetime.now().strftime('%H:%M')}",
         builder.as_markup()
     )
 
-async def send_daily_forecast(data: dict, days: int, callback: types.CallbackQuery):
-    forecasts = {}
-    for entry in data["list"]:
-        date = datetime.fromtimestamp(entry["dt"]).date()
-        forecasts.setdefault(date, []).append(entry)
+@dp.callback_query(F.data.startswith("sub_time_"))
+async def subscribe(callback: types.CallbackQuery, state: FSMContext):
+    _, _, kind, place_id, hour = callback.data.split("_")
+    if kind not in SUBSCRIPTION_KINDS or hour not in SUBSCRIPTION_TIMES:
+        await callback.answer()
+        return
+    hours, minutes = map(int, hour.split(":"))
+    minute = hours * 60 + minutes
 
-    sorted_dates = sorted(forecasts.keys())
-    response = []
+    async with async_session() as session:
+        owner_id, place = await get_own_place(session, callback.from_user.id, int(place_id))
+        if place is None:
+            await callback.answer("🚫 Это не ваше место!", show_alert=True)
+            return
+        await SubscriptionRepository.save(
+            session, owner_id, callback.message.chat.id, place.id, minute, kind, next_run_at(minute, time.time())
+        )
+
+    await edit_or_resend(
+        callback,
+        state,
+        f"✅ Прогноз «{SUBSCRIPTION_KINDS[kind]}» для {place.name} будет приходить каждый день в {hour}",
+        InlineKeyboardBuilder().button(text="← Назад", callback_data="main_menu").as_markup()
+    )
+
+@dp.callback_query(F.data.startswith("unsubscribe_"))
+async def unsubscribe(callback: types.CallbackQuery, state: FSMContext):
+    place_id = int(callback.data.split("_")[-1])
+
+    async with async_session() as session:
+        owner_id = await UserRepository.get_id(session, callback.from_user.id)
+        success = await SubscriptionRepository.delete(session, place_id, owner_id)
+
+    await edit_or_resend(
+        callback,
+        state,
+        "🔕 Подписка отменена" if success else "❌ Подписка не найдена",
+        InlineKeyboardBuilder().button(text="← Назад", callback_data=f"place_{place_id}").as_markup()
+    )
+
+@dp.callback_query(F.data.in_(["current", "today", "5days"]))
+async def process_forecast(callback: types.CallbackQuery, state: FSMContext):
+    coords = (await state.get_data()).get("coords")
+    if coords is None:
+        await callback.answer("❌ Сначала выберите местоположение!", show_alert=True)
+        return
+
+    lat, lon = coords
     
-    for date in sorted_dates[:days]:
-        daily_entries = forecasts[date]
-        day_name = get_day_name(date)
+    try:
+        forecast = await fetch_forecast(lat, lon)
+        # Готовый текст и клавиатура для ячейки, пока прогноз не обновился
+        rendered = render_view(cell_of(lat, lon).key, callback.data, forecast)
         
-        if days == 1:
-            response.append(f"📅 {day_name} ({date}):")
-            for entry in daily_entries:
-                time = datetime.fromtimestamp(entry["dt"]).strftime("%H:%M")
-                temp = entry["main"]["temp"]
-                humidity = entry["main"].get("humidity", "н/д")
-                desc = entry["weather"][0]["description"].capitalize()
-                wind_speed = entry["wind"]["speed"]
-                wind_deg = entry["wind"].get("deg")
-                response.append(
-                    f"⏰ {time}:\n"
-                    f"  🌡 {temp}°C\n"
-                    f"  💧 {humidity}%\n"
-                    f"  🌪 {wind_speed} м/с ({get_wind_direction(wind_deg)})\n"
-                    f"  ☁️ {desc}"
-                )
+        if callback.data == "current":
+            await send_current_weather(rendered, callback, state)
         else:
-            temp_min = min(e["main"]["temp_min"] for e in daily_entries)
-            temp_max = max(e["main"]["temp_max"] for e in daily_entries)
-            humidity_avg = round(sum(e["main"].get("humidity", 0) for e in daily_entries) / len(daily_entries))
-            wind_speeds = [e["wind"]["speed"] for e in daily_entries]
-            wind_deg = daily_entries[0]["wind"].get("deg")
-            desc = daily_entries[0]["weather"][0]["description"].capitalize()
-            
-            response.append(
-                f"📅 {day_name} ({date}):\n"
-                f"  🌡 {temp_min}°C...{temp_max}°C\n"
-                f"  💧 Влажность: ~{humidity_avg}%\n"
-                f"  🌪 Ветер: до {max(wind_speeds)} м/с ({get_wind_direction(wind_deg)})\n"
-                f"  ☁️ {desc}"
-            )
-    
-    builder = InlineKeyboardBuilder()
-    builder.button(text="← Назад", callback_data="main_menu")
+            await send_daily_forecast(rendered, callback, state)
+
+    except QuotaExhausted:
+        await callback.answer("⏳ Лимит запросов к сервису погоды исчерпан. Попробуйте позже.", show_alert=True)
+    except ForecastError:
+        await callback.answer("⛈ Ошибка сервера. Попробуйте позже.", show_alert=True)
+    except Exception:
+        logger.exception("Ошибка показа прогноза %s", callback.data)
+        await callback.answer("⛈ Ошибка запроса. Попробуйте позже.", show_alert=True)
+
+async def send_current_weather(rendered: RenderedView, callback: types.CallbackQuery, state: FSMContext):
+    if rendered.text is None:
+        await callback.answer("❌ Нет данных о текущей погоде.", show_alert=True)
+        return
     
-    await edit_or_resend(
-        callback,
-        "\n\n".join(response),
-        builder.as_markup()
-    )
+    await edit_or_resend(callback, state, rendered.text, rendered.markup)
+
+async def send_daily_forecast(rendered: RenderedView, callback: types.CallbackQuery, state: FSMContext):
+    await edit_or_resend(callback, state, rendered.text, rendered.markup)
     
+async def reindex_cells():
+    # Места, сохранённые до появления ячеек или при другой CELL_SCHEME
+    async with async_session() as session:
+        await PlaceRepository.reindex_cells(session)
+
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await migrate(engine)
+    await owm_client.start()
+    await preload_forecasts()
+    if config.METRICS_ENABLED:
+        background_tasks.add(asyncio.create_task(metrics.serve()))
+    if not config.RUN_BACKGROUND_JOBS:
+        return
+    background_tasks.add(asyncio.create_task(reindex_cells()))
+    background_tasks.add(asyncio.create_task(sweep_forecasts()))
+    if isinstance(dp.storage, SQLiteStorage):
+        background_tasks.add(asyncio.create_task(dp.storage.sweep()))
+    if config.PREFETCH_ENABLED:
+        background_tasks.add(asyncio.create_task(prefetcher.run()))
+    if config.SUBSCRIPTIONS_ENABLED:
+        background_tasks.add(asyncio.create_task(scheduler.run(bot)))
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await flush_persisted()
+    await owm_client.close()
 
 dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+async def run_polling():
+    # Telegram не отдаёт обновления через getUpdates, пока установлен webhook
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(dp.start_polling(bot))
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    if config.BOT_MODE == "webhook":
+        from webhook import run_webhook
+        run_webhook(dp, bot)
+    else:
+        asyncio.run(run_polling())
@@ -0,0 +1,222 @@
+# metrics.py
+import asyncio
+import bisect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # labels → [счётчики по корзинам (последняя — +Inf), сумма]
+        self.values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        item = self.values.get(labels)
+        if item is None:
+            item = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Registry:
+    """Набор метрик в текстовом формате Prometheus.
+
+    Обновление метрики — поиск в словаре и сложение; статистику кэшей
+    и лимитов собирают функции из on_collect при каждом запросе /metrics.
+    """
+
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def add(self, metric: _Metric) -> Any:
+        self.metrics.append(metric)
+        return metric
+
+    def on_collect(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception("Ошибка сбора метрик")
+        lines = [line for metric in self.metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+updates_in_flight = registry.add(Gauge("bot_updates_in_flight", "Обновления в обработке"))
+update_duration = registry.add(Histogram(
+    "bot_update_duration_seconds", "Время обработки обновления", ("type",)
+))
+update_errors = registry.add(Counter(
+    "bot_update_errors_total", "Необработанные исключения в обработчиках", ("type", "exception")
+))
+owm_duration = registry.add(Histogram("owm_request_duration_seconds", "Время запроса к OpenWeatherMap"))
+owm_responses = registry.add(Counter("owm_responses_total", "Ответы OpenWeatherMap по коду", ("status",)))
+db_duration = registry.add(Histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса", ("statement",), buckets=DB_BUCKETS
+))
+stats = registry.add(Gauge("bot_component_stat", "Статистика кэшей, лимитов и очередей", ("component", "stat")))
+
+
+def export_stats(component: str, source: Callable[[], dict]) -> None:
+    """Публикует числовые значения source() как bot_component_stat{component=...}."""
+    def collect() -> None:
+        for key, value in source().items():
+            if isinstance(value, (int, float)):
+                stats.set(component, key, value=value)
+    registry.on_collect(collect)
+
+
+# Метка — имя кнопки или команды без значений в конце callback_data (id места,
+# дата, час), иначе число рядов метрики росло бы с числом мест. callback_data
+# и команды приходят от клиента, поэтому всё, чего нет в списках ниже, — "other".
+# Списки повторяют обработчики из main.py
+_COMMANDS = frozenset({"/start"})
+_CALLBACKS = frozenset({
+    "main_menu", "current_location", "add_place", "delete_place",
+    "current", "today", "5days",
+    "compare_start", "compare_continue", "compare_execute", "compare_hours",
+    "compare_hours_select_all", "compare_hours_deselect_all",
+})
+_CALLBACK_PREFIXES = (
+    "place_", "compare_place_", "compare_day_", "compare_hour_",
+    "delete_confirm_", "delete_final_",
+    "subscribe_", "sub_kind_", "sub_time_", "unsubscribe_",
+)
+
+
+def _callback_type(data: str) -> str:
+    if data in _CALLBACKS:
+        return data
+    for prefix in _CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix[:-1]
+    return "other"
+
+
+def update_type(update: Update) -> str:
+    if update.callback_query is not None:
+        return _callback_type(update.callback_query.data or "")
+    if update.message is not None:
+        text = update.message.text
+        if not (text and text.startswith("/")):
+            content_type = update.message.content_type
+            return f"message:{getattr(content_type, 'value', content_type)}"
+        command = text.split()[0].split("@")[0]
+        return command if command in _COMMANDS else "other"
+    return update.event_type
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        kind = update_type(event)
+        updates_in_flight.inc(amount=1)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            update_errors.inc(kind, type(e).__name__)
+            raise
+        finally:
+            update_duration.observe(time.perf_counter() - started, kind)
+            updates_in_flight.inc(amount=-1)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve() -> None:
+    """HTTP-сервер /metrics; работает, пока задачу не отменят."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.METRICS_HOST, config.METRICS_PORT).start()
+        logger.info("Метрики доступны на http://%s:%d/metrics", config.METRICS_HOST, config.METRICS_PORT)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,148 @@
+# outbound.py
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+import config
+from cache import TTLCache
+from weather.quota import Priority, QuotaGovernor
+
+logger = logging.getLogger(__name__)
+
+# Приоритет исходящих сообщений в текущей задаче: рассылки выставляют BULK,
+# чтобы не задерживать ответы на нажатия
+send_priority: ContextVar[Priority] = ContextVar("send_priority", default=Priority.INTERACTIVE)
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+def _markup_hash(markup: Any) -> int:
+    return hash(markup.model_dump_json(exclude_none=True)) if markup is not None else 0
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Исходящие запросы к Bot API: лимиты, повтор после RetryAfter и пропуск пустых правок.
+
+    Общий темп задаёт QuotaGovernor (очередь по приоритету send_priority),
+    темп на чат — GCRA с запасом chat_burst. Для отправленных сообщений
+    запоминаются хэши текста и клавиатуры: правка без изменений не уходит
+    в Telegram, а ответ "message is not modified" считается успехом.
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        burst: int,
+        chat_rate: float,
+        chat_burst: int,
+        max_retries: int,
+        sent_ttl: float,
+        sent_size: int
+    ):
+        self.limiter = QuotaGovernor(rate_per_minute=rate_per_second * 60, burst=burst, daily_limit=None)
+        self.chat_interval = 1 / chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.skipped = 0
+        self.retried = 0
+        # (chat_id, message_id) → (хэш текста, хэш клавиатуры)
+        self._sent: TTLCache[tuple[int, int]] = TTLCache(ttl=sent_ttl, maxsize=sent_size)
+        # chat_id → время, к которому чат «расплатится» за уже отправленное (GCRA)
+        self._chats: TTLCache[float] = TTLCache(ttl=60 + chat_burst * self.chat_interval, maxsize=sent_size)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        api_method = method.__api_method__
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not api_method.startswith(_LIMITED_PREFIXES):
+            result = await make_request(bot, method)
+            if api_method == "deleteMessage":
+                self._sent.pop((method.chat_id, method.message_id))
+            return result
+
+        message_id = getattr(method, "message_id", None)
+        fingerprint = self._fingerprint(method, chat_id, message_id)
+        if fingerprint is not None and self._sent.get((chat_id, message_id)) == fingerprint:
+            self.skipped += 1
+            return True
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self.limiter.acquire(send_priority.get())
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                logger.warning("%s: flood control, повтор через %d с", api_method, e.retry_after)
+                self._chats.set(chat_id, time.monotonic() + e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramBadRequest as e:
+                if not api_method.startswith("edit") or "message is not modified" not in e.message:
+                    raise
+                self.skipped += 1
+                result = True
+            break
+
+        if fingerprint is not None:
+            self._sent.set((chat_id, message_id), fingerprint)
+        elif isinstance(result, Message) and api_method == "sendMessage":
+            self._sent.set((chat_id, result.message_id), (hash(method.text), _markup_hash(method.reply_markup)))
+        return result
+
+    def share(self, parts: int) -> None:
+        self.limiter.share(parts)
+
+    def stats(self) -> dict:
+        return {
+            "skipped": self.skipped,
+            "retried": self.retried,
+            "queued": self.limiter.stats()["queued"],
+            "granted": self.limiter.granted,
+        }
+
+    def _fingerprint(self, method: TelegramMethod, chat_id: int, message_id: int | None) -> tuple[int, int] | None:
+        # Хэши содержимого после правки; None — запрос не является правкой известного сообщения
+        if message_id is None:
+            return None
+        if method.__api_method__ == "editMessageText":
+            return hash(method.text), _markup_hash(method.reply_markup)
+        if method.__api_method__ == "editMessageReplyMarkup":
+            previous = self._sent.peek((chat_id, message_id))
+            if previous is None:
+                return None
+            return previous[0], _markup_hash(method.reply_markup)
+        return None
+
+    async def _wait_chat(self, chat_id: int) -> None:
+        now = time.monotonic()
+        tat = max(self._chats.peek(chat_id) or now, now)
+        self._chats.set(chat_id, tat + self.chat_interval)
+        delay = tat - now - (self.chat_burst - 1) * self.chat_interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+outbound = OutboundMiddleware(
+    rate_per_second=config.OUTBOUND_RATE,
+    burst=config.OUTBOUND_BURST,
+    chat_rate=config.OUTBOUND_CHAT_RATE,
+    chat_burst=config.OUTBOUND_CHAT_BURST,
+    max_retries=config.OUTBOUND_MAX_RETRIES,
+    sent_ttl=config.OUTBOUND_SENT_TTL,
+    sent_size=config.OUTBOUND_SENT_SIZE
+)
@@ -0,0 +1,174 @@
+# state.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+import codec
+import config
+from database.db import async_session
+from database.repository import StateRepository
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class PlaceForm(StatesGroup):
+    adding = State()
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self):
+        self.state: str | None = None
+        self.data: dict[str, Any] = {}
+        self.touched = time.monotonic()
+
+
+class TTLMemoryStorage(BaseStorage):
+    """FSM-хранилище в памяти с ограничением по времени и размеру.
+
+    Состояние пользователя удаляется, если к нему не обращались ttl секунд;
+    при превышении maxsize вытесняются давно неактивные пользователи.
+    В data ожидаются только простые данные (числа, строки, списки).
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.evicted = 0
+        self._records: OrderedDict[StorageKey, _Record] = OrderedDict()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._touch(key, create=True)
+        record.state = state.state if isinstance(state, State) else state
+        self._drop_if_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = self._touch(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = self._touch(key, create=True)
+        record.data = dict(data)
+        self._drop_if_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = self._touch(key)
+        return dict(record.data) if record else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+
+    def stats(self) -> dict:
+        return {"users": len(self._records), "evicted": self.evicted}
+
+    def _touch(self, key: StorageKey, create: bool = False) -> _Record | None:
+        now = time.monotonic()
+        record = self._records.get(key)
+        if record is not None and now - record.touched >= self.ttl:
+            del self._records[key]
+            self.evicted += 1
+            record = None
+        if record is None:
+            if not create:
+                return None
+            record = self._records[key] = _Record()
+            self._evict(now)
+        else:
+            self._records.move_to_end(key)
+        record.touched = now
+        return record
+
+    def _evict(self, now: float) -> None:
+        # Записи упорядочены по последнему обращению: устаревшие всегда в начале
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if now - record.touched < self.ttl and len(self._records) <= self.maxsize:
+                break
+            del self._records[key]
+            self.evicted += 1
+
+    def _drop_if_empty(self, key: StorageKey, record: _Record) -> None:
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в общей базе (таблица fsm_state).
+
+    Используется в многопроцессном режиме: состояние пользователя видят все
+    воркеры и оно переживает перезапуск воркера. Срок жизни записи — ttl
+    секунд с последнего изменения; устаревшие записи удаляет sweep().
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        _, data = await self._load(key)
+        await self._save(key, state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        state, _ = await self._load(key)
+        await self._save(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(key)
+        return data
+
+    async def close(self) -> None:
+        pass
+
+    async def sweep(self) -> None:
+        while True:
+            await asyncio.sleep(config.STATE_SWEEP_INTERVAL)
+            try:
+                async with async_session() as session:
+                    removed = await StateRepository.delete_expired(session, time.time() - self.ttl)
+                if removed:
+                    logger.info("Удалено устаревших FSM-записей: %d", removed)
+            except Exception:
+                logger.exception("Не удалось очистить таблицу fsm_state")
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny]
+        if key.business_connection_id:
+            parts.append(key.business_connection_id)
+        return ":".join(map(str, parts))
+
+    @traced("fsm.load")
+    async def _load(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        async with async_session() as session:
+            record = await StateRepository.get(session, self._key(key), time.time() - self.ttl)
+        if record is None:
+            return None, {}
+        return record.state, codec.loads(record.data)
+
+    @traced("fsm.save")
+    async def _save(self, key: StorageKey, state: str | None, data: dict[str, Any]) -> None:
+        async with async_session() as session:
+            if state is None and not data:
+                await StateRepository.delete(session, self._key(key))
+            else:
+                await StateRepository.save(session, self._key(key), state, codec.dumps(data), time.time())
+
+
+def create_storage() -> BaseStorage:
+    """FSM-хранилище по STATE_BACKEND: memory, sqlite или redis."""
+    if config.STATE_BACKEND == "redis":
+        # Требует пакет redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(config.REDIS_URL, state_ttl=config.STATE_TTL, data_ttl=config.STATE_TTL)
+    if config.STATE_BACKEND == "sqlite":
+        return SQLiteStorage(ttl=config.STATE_TTL)
+    return TTLMemoryStorage(ttl=config.STATE_TTL, maxsize=config.STATE_MAX_USERS)
@@ -0,0 +1,177 @@
+# subscriptions.py
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+import config
+from database.db import async_session
+from database.models import DueSubscription
+from database.repository import SubscriptionRepository
+from outbound import send_priority
+from weather.cells import cell_from_key, cell_of, cell_prefix
+from weather.forecast import fetch_forecast
+from weather.models import Forecast
+from weather.quota import Priority
+from views import prerender_5days, render_view
+
+logger = logging.getLogger(__name__)
+
+_MENU_MARKUP = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🌤 Главное меню", callback_data="main_menu")]
+])
+
+
+def next_run_at(minute: int, after: float) -> float:
+    """Ближайшее время доставки (минуты от полуночи по времени сервера) строго позже after."""
+    moment = datetime.fromtimestamp(after)
+    run = moment.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+    if run.timestamp() <= after:
+        run += timedelta(days=1)
+    return run.timestamp()
+
+
+class SubscriptionScheduler:
+    """Доставка ежедневных прогнозов по подпискам.
+
+    Раз в interval секунд забирает до batch наступивших подписок и сразу
+    переносит их на следующий день, поэтому после сбоя прогноз не придёт
+    дважды. Подписки группируются по ячейке места: прогноз ячейки
+    запрашивается один раз с приоритетом BULK, текст для пары (ячейка, вид)
+    берётся из views.render_view; 5-дневные тексты всех ячеек пачки считаются
+    одной агрегацией (views.prerender_5days). Сообщения уходят с send_priority
+    BULK через outbound, который держит темп Telegram и пропускает вперёд
+    ответы на нажатия.
+    Подписки, опоздавшие больше чем на max_delay (бот был выключен),
+    пропускаются до следующего дня.
+    """
+
+    def __init__(self, interval: float, batch: int, fetch_concurrency: int, send_concurrency: int, max_delay: float):
+        self.interval = interval
+        self.batch = batch
+        self.max_delay = max_delay
+        self._fetch_limit = asyncio.Semaphore(fetch_concurrency)
+        self._send_limit = asyncio.Semaphore(send_concurrency)
+        self.delivered = 0
+        self.failed = 0
+        self.skipped = 0
+        self.blocked = 0
+        self.cells = 0
+
+    async def run(self, bot: Bot) -> None:
+        send_priority.set(Priority.BULK)
+        while True:
+            try:
+                # Полная пачка — возможно, наступили ещё подписки
+                while await self.deliver_due(bot) >= self.batch:
+                    pass
+            except Exception as e:
+                logger.warning("Ошибка доставки подписок: %r", e)
+            await asyncio.sleep(self.interval)
+
+    async def deliver_due(self, bot: Bot) -> int:
+        now = time.time()
+        async with async_session() as session:
+            due = await SubscriptionRepository.get_due(session, now, self.batch)
+            if not due:
+                return 0
+            await SubscriptionRepository.reschedule(
+                session, [(subscription.id, next_run_at(subscription.minute, now)) for subscription in due]
+            )
+
+        by_cell: dict[str, list[DueSubscription]] = {}
+        prefix = cell_prefix()
+        for subscription in due:
+            if now - subscription.next_run > self.max_delay:
+                self.skipped += 1
+                continue
+            # places.cell мог ещё не пересчитаться после смены CELL_SCHEME
+            cell = subscription.cell
+            if cell is None or not cell.startswith(prefix):
+                cell = cell_of(subscription.lat, subscription.lon).key
+            by_cell.setdefault(cell, []).append(subscription)
+
+        # Сначала прогнозы всех ячеек пачки: 5-дневные тексты для них
+        # считаются вместе, а дальше берутся из кэша views
+        forecasts = await asyncio.gather(*(
+            self._fetch_cell(cell, len(subscriptions)) for cell, subscriptions in by_cell.items()
+        ))
+        loaded = [
+            (cell, subscriptions, forecast)
+            for (cell, subscriptions), forecast in zip(by_cell.items(), forecasts)
+            if forecast is not None
+        ]
+        prerender_5days([
+            (cell, forecast) for cell, subscriptions, forecast in loaded
+            if any(subscription.kind == "5days" for subscription in subscriptions)
+        ])
+
+        blocked: list[int] = []
+        await asyncio.gather(*(
+            self._deliver_cell(bot, cell, subscriptions, forecast, blocked) for cell, subscriptions, forecast in loaded
+        ))
+        if blocked:
+            self.blocked += len(blocked)
+            async with async_session() as session:
+                await SubscriptionRepository.delete_for_chats(session, blocked)
+        return len(due)
+
+    async def _fetch_cell(self, cell: str, subscribers: int) -> Forecast | None:
+        center = cell_from_key(cell)
+        try:
+            async with self._fetch_limit:
+                forecast = await fetch_forecast(center.lat, center.lon, priority=Priority.BULK)
+        except Exception as e:
+            self.failed += subscribers
+            logger.warning("Нет прогноза для ячейки %s, подписок: %d: %r", cell, subscribers, e)
+            return None
+        self.cells += 1
+        return forecast
+
+    async def _deliver_cell(
+        self,
+        bot: Bot,
+        cell: str,
+        subscriptions: list[DueSubscription],
+        forecast: Forecast,
+        blocked: list[int]
+    ) -> None:
+        # Вид подписки (today, 5days) совпадает с видом прогноза в views
+        texts = {
+            kind: render_view(cell, kind, forecast).text
+            for kind in {subscription.kind for subscription in subscriptions}
+        }
+        await asyncio.gather(*(
+            self._send(bot, subscription.chat_id, f"🔔 {subscription.place_name}\n\n{texts[subscription.kind]}", blocked)
+            for subscription in subscriptions
+        ))
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, blocked: list[int]) -> None:
+        async with self._send_limit:
+            try:
+                await bot.send_message(chat_id, text, reply_markup=_MENU_MARKUP)
+                self.delivered += 1
+            except TelegramForbiddenError:
+                blocked.append(chat_id)
+            except Exception as e:
+                self.failed += 1
+                logger.debug("Не удалось отправить подписку в чат %s: %r", chat_id, e)
+
+    def stats(self) -> dict:
+        return {
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "skipped_late": self.skipped,
+            "blocked": self.blocked,
+            "cells": self.cells,
+        }
+
+scheduler = SubscriptionScheduler(
+    interval=config.SUBSCRIPTION_INTERVAL,
+    batch=config.SUBSCRIPTION_BATCH,
+    fetch_concurrency=config.SUBSCRIPTION_FETCH_CONCURRENCY,
+    send_concurrency=config.SUBSCRIPTION_SEND_CONCURRENCY,
+    max_delay=config.SUBSCRIPTION_MAX_DELAY
+)
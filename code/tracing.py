@@ -0,0 +1,148 @@
+# tracing.py
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+import config
+from metrics import update_type
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+class Span:
+    __slots__ = ("name", "started", "duration", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration: float | None = None
+        self.children: list[Span] = []
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+
+    def format(self, origin: float | None = None, depth: int = 0) -> Iterator[str]:
+        origin = self.started if origin is None else origin
+        duration = f"{self.duration * 1000:8.1f} мс" if self.duration is not None else "   не завершён"
+        yield f"{'  ' * depth}{self.name:<{48 - 2 * depth}} +{(self.started - origin) * 1000:7.1f} {duration}"
+        for child in self.children:
+            yield from child.format(origin, depth + 1)
+
+
+# Текущий span задачи; None — обновление не трассируется и span() ничего не делает.
+# Задачи из asyncio.gather наследуют контекст, поэтому их span попадают в дерево родителя
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[Span | None]:
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current.reset(token)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Декоратор async-функции: вызов записывается в span name."""
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return await fn(*args, **kwargs)
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Каждый запрос к Bot API — span tg.<метод>, включая ожидание лимитов outbound."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        with span(f"tg.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+def _slow_log() -> logging.Logger:
+    slow = logging.getLogger("slow_updates")
+    if not slow.handlers:
+        handler = logging.FileHandler(config.SLOW_UPDATE_LOG, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow.addHandler(handler)
+        slow.setLevel(logging.INFO)
+        slow.propagate = False
+    return slow
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Трассировка обновлений: дерево span медленного обновления пишется в SLOW_UPDATE_LOG.
+
+    С вероятностью PROFILE_SAMPLE_RATE обновление дополнительно профилируется
+    cProfile. Профилировщик один на поток, поэтому в профиль попадают и
+    параллельно обрабатываемые обновления; пока он занят, выборка пропускается.
+    """
+
+    def __init__(self, threshold: float, profile_rate: float):
+        self.threshold = threshold
+        self.profile_rate = profile_rate
+        self.slow = 0
+        self._profiling = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        root = Span(f"update:{update_type(event)}")
+        token = _current.set(root)
+        profiler = None
+        if self.profile_rate and not self._profiling and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+            self._profiling = True
+            profiler.enable()
+        try:
+            return await handler(event, data)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            _current.reset(token)
+            root.finish()
+            if root.duration >= self.threshold:
+                self.slow += 1
+                self._dump(event, root, profiler)
+
+    def _dump(self, event: TelegramObject, root: Span, profiler: cProfile.Profile | None) -> None:
+        lines = [f"Медленное обновление {event.update_id}: {root.duration * 1000:.0f} мс", *root.format()]
+        if profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(config.PROFILE_TOP)
+            lines.append(stream.getvalue())
+        _slow_log().info("\n".join(lines))
@@ -0,0 +1,72 @@
+# views.py
+from typing import Callable, NamedTuple, Sequence
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+import config
+from cache import TTLCache
+from tracing import span
+from weather.aggregate import daily_summaries
+from weather.models import Forecast
+from weather.render import render_current, render_daily
+
+# Готовые сообщения с прогнозом: текст и клавиатура. Ключ — ячейка, вид
+# прогноза и время получения прогноза (fetched_at): после обновления прогноза
+# старые записи просто перестают запрашиваться и вытесняются, а живут не
+# дольше самого прогноза в forecast_cache.
+
+
+class RenderedView(NamedTuple):
+    text: str | None
+    markup: InlineKeyboardMarkup
+
+
+# Одна клавиатура на все сообщения; aiogram не меняет её при отправке,
+# обработчики тоже не должны
+BACK_MARKUP = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="← Назад", callback_data="main_menu")]
+])
+
+VIEWS: dict[str, Callable[[Forecast], str | None]] = {
+    "current": render_current,
+    "today": lambda forecast: render_daily(forecast, 1),
+    "5days": lambda forecast: render_daily(forecast, 5),
+}
+
+rendered_views: TTLCache[RenderedView] = TTLCache(
+    ttl=config.FORECAST_CACHE_TTL,
+    maxsize=config.RENDER_CACHE_SIZE
+)
+
+
+def render_view(cell: str, view: str, forecast: Forecast) -> RenderedView:
+    if forecast.stale:
+        # В тексте возраст данных, он меняется каждую минуту
+        with span(f"render.{view}"):
+            return RenderedView(VIEWS[view](forecast), BACK_MARKUP)
+
+    key = (cell, view, forecast.fetched_at)
+    rendered = rendered_views.get(key)
+    if rendered is None:
+        with span(f"render.{view}"):
+            rendered = RenderedView(VIEWS[view](forecast), BACK_MARKUP)
+        rendered_views.set(key, rendered, forecast.fetched_at)
+    return rendered
+
+
+def prerender_5days(cells: Sequence[tuple[str, Forecast]]) -> int:
+    """Кладёт в кэш 5-дневные сообщения сразу для многих ячеек.
+
+    Сводки по дням всех ещё не отрисованных прогнозов считаются одним вызовом
+    daily_summaries — на больших пачках это столбцовый расчёт на numpy.
+    """
+    missing = [
+        (cell, forecast) for cell, forecast in cells
+        if not forecast.stale and rendered_views.peek((cell, "5days", forecast.fetched_at)) is None
+    ]
+    if not missing:
+        return 0
+    with span("render.5days_batch"):
+        summaries = daily_summaries([forecast for _, forecast in missing])
+        for (cell, forecast), days in zip(missing, summaries):
+            rendered = RenderedView(render_daily(forecast, 5, days), BACK_MARKUP)
+            rendered_views.set((cell, "5days", forecast.fetched_at), rendered, forecast.fetched_at)
+    return len(missing)
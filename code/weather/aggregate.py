@@ -0,0 +1,221 @@
+# weather/aggregate.py
+from dataclasses import dataclass
+from datetime import date
+from typing import Sequence
+import config
+from .models import Forecast, ForecastEntry
+
+# Агрегация прогнозов для 5-дневного вида, сравнения мест и рассылки подписок.
+# С numpy (если установлен и AGGREGATE_ENGINE != python) сводки по многим
+# прогнозам сразу (пачка ячеек в subscriptions.py) считаются по столбцам:
+# записи всех мест группируются по (место, день) за один проход. Без numpy
+# и на малых пачках — тот же расчёт на чистом Python. Результаты совпадают
+# с точностью до округления float: numpy складывает в другом порядке
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+@dataclass(slots=True)
+class DailySummary:
+    date: date
+    count: int
+    temp_min: float | None
+    temp_max: float | None
+    temp_mean: float | None
+    humidity_mean: float | None
+    wind_max: float | None
+    # Преобладающий румб ветра 0..7 (0 — северный), как в get_wind_direction
+    wind_sector: int | None
+    description: str | None
+
+
+# День → час → [(индекс прогноза, запись)]
+Slots = dict[date, dict[str, list[tuple[int, ForecastEntry]]]]
+
+
+def wind_sector(deg: float | None) -> int | None:
+    return round(deg / 45) % 8 if deg else None
+
+
+def _mode(counts: dict) -> object | None:
+    # dict хранит порядок вставки, max берёт первый из равных — раньше встретившийся
+    return max(counts, key=counts.__getitem__) if counts else None
+
+
+def _summarize(day: date, entries: list[ForecastEntry]) -> DailySummary:
+    temp_total = 0.0
+    temp_count = 0
+    temp_min = temp_max = wind_max = None
+    humidity_total = humidity_count = 0
+    sectors: dict[int, int] = {}
+    descriptions: dict[str, int] = {}
+    for e in entries:
+        if e.temp is not None:
+            temp_total += e.temp
+            temp_count += 1
+        if e.temp_min is not None and (temp_min is None or e.temp_min < temp_min):
+            temp_min = e.temp_min
+        if e.temp_max is not None and (temp_max is None or e.temp_max > temp_max):
+            temp_max = e.temp_max
+        if e.wind_speed is not None and (wind_max is None or e.wind_speed > wind_max):
+            wind_max = e.wind_speed
+        if e.humidity is not None:
+            humidity_total += e.humidity
+            humidity_count += 1
+        if e.wind_deg:
+            sector = round(e.wind_deg / 45) % 8
+            sectors[sector] = sectors.get(sector, 0) + 1
+        descriptions[e.description] = descriptions.get(e.description, 0) + 1
+    return DailySummary(
+        date=day,
+        count=len(entries),
+        temp_min=temp_min,
+        temp_max=temp_max,
+        temp_mean=temp_total / temp_count if temp_count else None,
+        humidity_mean=humidity_total / humidity_count if humidity_count else None,
+        wind_max=wind_max,
+        wind_sector=_mode(sectors),
+        description=_mode(descriptions)
+    )
+
+
+def _daily_python(forecasts: Sequence[Forecast]) -> list[list[DailySummary]]:
+    return [
+        [_summarize(day, entries) for day, entries in sorted(forecast.by_date().items())]
+        for forecast in forecasts
+    ]
+
+
+class _Columns:
+    """Записи одного прогноза по столбцам; строится один раз и хранится в Forecast.columns."""
+
+    __slots__ = ("values", "day", "description", "names")
+
+    def __init__(self, entries: Sequence[ForecastEntry]):
+        n = len(entries)
+        # temp, temp_min, temp_max, humidity, wind_speed, wind_deg; None → NaN
+        self.values = np.array(
+            [(e.temp, e.temp_min, e.temp_max, e.humidity, e.wind_speed, e.wind_deg) for e in entries], dtype=float
+        ).reshape(n, 6)
+        self.day = np.fromiter((e.date.toordinal() for e in entries), dtype=np.int64, count=n)
+        names: dict[str, int] = {}
+        self.description = np.fromiter(
+            (names.setdefault(e.description, len(names)) for e in entries), dtype=np.int64, count=n
+        )
+        self.names = list(names)
+
+
+def _columns(forecast: Forecast) -> _Columns:
+    if forecast.columns is None:
+        forecast.columns = _Columns(forecast.entries)
+    return forecast.columns
+
+
+def _mode_numpy(group, codes, groups: int):
+    """Преобладающий код в каждой группе; -1 — пропуск. Записи упорядочены по времени."""
+    valid = codes >= 0
+    group, codes = group[valid], codes[valid]
+    positions = np.flatnonzero(valid)
+    width = int(codes.max()) + 1 if codes.size else 1
+    counts = np.zeros((groups, width), dtype=np.int64)
+    first = np.full((groups, width), len(valid), dtype=np.int64)
+    np.add.at(counts, (group, codes), 1)
+    np.minimum.at(first, (group, codes), positions)
+    # Больше повторов, при равенстве — раньше встретившийся
+    score = np.where(counts > 0, counts * (len(valid) + 1) - first, -1)
+    result = score.argmax(axis=1)
+    return np.where(score.max(axis=1) >= 0, result, -1)
+
+
+def _daily_numpy(forecasts: Sequence[Forecast]) -> list[list[DailySummary]]:
+    result: list[list[DailySummary]] = [[] for _ in forecasts]
+    if not any(forecast.entries for forecast in forecasts):
+        return result
+
+    columns = [_columns(forecast) for forecast in forecasts]
+    place = np.repeat(np.arange(len(forecasts)), [len(c.day) for c in columns])
+    day = np.concatenate([c.day for c in columns])
+    values = np.concatenate([c.values for c in columns])
+
+    # Коды описаний общие для всех прогнозов
+    names: dict[str, int] = {}
+    description = np.concatenate([
+        np.array([names.setdefault(name, len(names)) for name in c.names], dtype=np.int64)[c.description]
+        for c in columns if c.names
+    ])
+
+    # Группа — пара (место, день); записи прогноза уже идут по времени,
+    # поэтому группы получаются непрерывными отрезками
+    first_day = int(day.min())
+    group_key = place * (int(day.max()) - first_day + 1) + day - first_day
+    starts = np.flatnonzero(np.diff(group_key, prepend=-1))
+    group = np.cumsum(np.diff(group_key, prepend=-1) != 0) - 1
+    groups = len(starts)
+    counts = np.diff(np.append(starts, len(day)))
+
+    _, temp_min, temp_max, _, wind, deg = values.T
+    # Румб как в wind_sector: нулевое и пропущенное направление не учитываются
+    with np.errstate(invalid="ignore"):
+        sectors = np.where(np.isnan(deg) | (deg == 0), -1, np.round(deg / 45) % 8).astype(np.int64)
+    present = ~np.isnan(values)
+    totals = np.add.reduceat(np.where(present, values, 0.0), starts)
+    present_counts = np.add.reduceat(present.astype(np.int64), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = totals / present_counts
+
+    rows = zip(
+        place[starts].tolist(),
+        day[starts].tolist(),
+        counts.tolist(),
+        np.fmin.reduceat(temp_min, starts).tolist(),
+        np.fmax.reduceat(temp_max, starts).tolist(),
+        means[:, 0].tolist(),
+        means[:, 3].tolist(),
+        np.fmax.reduceat(wind, starts).tolist(),
+        _mode_numpy(group, sectors, groups).tolist(),
+        _mode_numpy(group, description, groups).tolist()
+    )
+    names_list = list(names)
+    # NaN != NaN: так пропуски превращаются в None
+    for index, ordinal, count, low, high, mean, humidity_mean, wind_max, sector, dominant in rows:
+        result[index].append(DailySummary(
+            date=date.fromordinal(ordinal),
+            count=count,
+            temp_min=low if low == low else None,
+            temp_max=high if high == high else None,
+            temp_mean=mean if mean == mean else None,
+            humidity_mean=humidity_mean if humidity_mean == humidity_mean else None,
+            wind_max=wind_max if wind_max == wind_max else None,
+            wind_sector=sector if sector >= 0 else None,
+            description=names_list[dominant] if dominant >= 0 else None
+        ))
+    return result
+
+
+_numpy = np is not None and config.AGGREGATE_ENGINE != "python"
+ENGINE = "numpy" if _numpy else "python"
+
+# На нескольких прогнозах разложение по столбцам дороже самой агрегации
+NUMPY_MIN_FORECASTS = 10
+
+
+def daily_summaries(forecasts: Sequence[Forecast]) -> list[list[DailySummary]]:
+    """Сводка по дням для каждого прогноза: result[i] — дни forecasts[i] по возрастанию даты."""
+    if _numpy and len(forecasts) >= NUMPY_MIN_FORECASTS:
+        return _daily_numpy(forecasts)
+    return _daily_python(forecasts)
+
+
+def hourly_slots(forecasts: Sequence[Forecast], days: set[date], hours: set[str]) -> Slots:
+    """Записи выбранных дней и часов: день → час → [(индекс прогноза, запись)], всё по возрастанию.
+
+    Каждая запись попадает в ответ как есть, поэтому numpy здесь не быстрее одного прохода по словарю.
+    """
+    slots: Slots = {}
+    for index, forecast in enumerate(forecasts):
+        for entry in forecast.entries:
+            if entry.date in days and entry.hour in hours:
+                slots.setdefault(entry.date, {}).setdefault(entry.hour, []).append((index, entry))
+    return {day: dict(sorted(slots[day].items())) for day in sorted(slots)}
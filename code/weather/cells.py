@@ -0,0 +1,162 @@
+# weather/cells.py
+import argparse
+import asyncio
+import math
+from typing import NamedTuple
+from sqlalchemy import select
+import config
+
+# Координаты привязываются к ячейкам: всем точкам ячейки достаётся один
+# прогноз, запрошенный для её центра. Схема CELL_SCHEME:
+#   grid    — сетка с шагом CELL_SIZE градусов (0.02° ≈ 2.2 км по широте)
+#   geohash — geohash длины CELL_GEOHASH_PRECISION (5 знаков ≈ 4.9 × 4.9 км)
+# Ключ ячейки начинается с параметров схемы ("g0.02:", "h5:"), поэтому после
+# их смены старые ключи в кэше и в places.cell просто перестают совпадать.
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+class Cell(NamedTuple):
+    key: str
+    # Центр ячейки — для этих координат запрашивается прогноз
+    lat: float
+    lon: float
+
+
+def _normalize_lon(lon: float) -> float:
+    return (lon + 180) % 360 - 180
+
+
+def _grid_center(size: float, row: int, column: int) -> tuple[float, float]:
+    lat = min(-90 + (row + 0.5) * size, 90.0)
+    lon = _normalize_lon(-180 + (column + 0.5) * size)
+    return round(lat, 6), round(lon, 6)
+
+
+def grid_cell(lat: float, lon: float, size: float) -> Cell:
+    rows = math.ceil(180 / size)
+    row = min(max(math.floor((lat + 90) / size), 0), rows - 1)
+    column = math.floor((_normalize_lon(lon) + 180) / size)
+    return Cell(f"g{size:g}:{row}:{column}", *_grid_center(size, row, column))
+
+
+def _geohash_bounds(geohash: str) -> tuple[float, float]:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            # Чётные биты делят долготу, нечётные — широту
+            bounds = lon_range if even else lat_range
+            middle = (bounds[0] + bounds[1]) / 2
+            if bits >> shift & 1:
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+    return round((lat_range[0] + lat_range[1]) / 2, 6), round((lon_range[0] + lon_range[1]) / 2, 6)
+
+
+def geohash(lat: float, lon: float, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    lon = _normalize_lon(lon)
+    chars = []
+    even = True
+    for _ in range(precision):
+        bits = 0
+        for _ in range(5):
+            value, bounds = (lon, lon_range) if even else (lat, lat_range)
+            middle = (bounds[0] + bounds[1]) / 2
+            bits <<= 1
+            if value >= middle:
+                bits |= 1
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+        chars.append(_BASE32[bits])
+    return "".join(chars)
+
+
+def geohash_cell(lat: float, lon: float, precision: int) -> Cell:
+    code = geohash(lat, lon, precision)
+    return Cell(f"h{precision}:{code}", *_geohash_bounds(code))
+
+
+def cell_of(
+    lat: float,
+    lon: float,
+    scheme: str = config.CELL_SCHEME,
+    size: float = config.CELL_SIZE,
+    precision: int = config.CELL_GEOHASH_PRECISION
+) -> Cell:
+    if scheme == "geohash":
+        return geohash_cell(lat, lon, precision)
+    return grid_cell(lat, lon, size)
+
+
+def cell_prefix(
+    scheme: str = config.CELL_SCHEME,
+    size: float = config.CELL_SIZE,
+    precision: int = config.CELL_GEOHASH_PRECISION
+) -> str:
+    """Начало всех ключей схемы; places.cell с другим началом нужно пересчитать."""
+    return f"h{precision}:" if scheme == "geohash" else f"g{size:g}:"
+
+
+def cell_from_key(key: str) -> Cell:
+    """Ячейка с центром по её ключу — например, из places.cell."""
+    params, _, rest = key.partition(":")
+    if params.startswith("h"):
+        return Cell(key, *_geohash_bounds(rest))
+    row, column = rest.split(":")
+    return Cell(key, *_grid_center(float(params[1:]), int(row), int(column)))
+
+
+# python -m weather.cells [--grid 0.01 0.05] [--geohash 4 6] — сколько ячеек
+# занимают все сохранённые места при текущей схеме и при альтернативных
+async def report(schemes: list[tuple[str, float, int]]) -> None:
+    from database.db import async_session
+    from database.models import Place
+
+    places = 0
+    points: set[tuple[float, float]] = set()
+    cells: list[set[str]] = [set() for _ in schemes]
+    async with async_session() as session:
+        result = await session.stream(select(Place.lat, Place.lon).execution_options(yield_per=10000))
+        async for lat, lon in result:
+            places += 1
+            points.add((round(lat, 4), round(lon, 4)))
+            for found, (scheme, size, precision) in zip(cells, schemes):
+                found.add(cell_of(lat, lon, scheme, size, precision).key)
+
+    # Верхняя оценка: каждая ячейка обновляется раз в FORECAST_CACHE_TTL круглые сутки
+    refreshes = 86400 / config.FORECAST_CACHE_TTL
+    print(f"Мест: {places}, различных координат (4 знака): {len(points)}")
+    print(f"Дневной лимит OWM: {config.OWM_DAILY_LIMIT}, обновлений ячейки в сутки: {refreshes:g}\n")
+    print(f"{'схема':<16}{'ячеек':>10}{'мест на ячейку':>16}{'запросов в сутки':>18}")
+    for found, scheme in zip(cells, schemes):
+        name = cell_prefix(*scheme).rstrip(":")
+        if scheme == (config.CELL_SCHEME, config.CELL_SIZE, config.CELL_GEOHASH_PRECISION):
+            name += " *"
+        per_cell = places / len(found) if found else 0
+        print(f"{name:<16}{len(found):>10}{per_cell:>16.1f}{len(found) * refreshes:>18.0f}")
+    print("\n* — текущая схема")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сколько ячеек занимают сохранённые места")
+    parser.add_argument("--grid", type=float, nargs="*", default=[], help="дополнительные шаги сетки, градусы")
+    parser.add_argument("--geohash", type=int, nargs="*", default=[], help="дополнительные длины geohash")
+    args = parser.parse_args()
+
+    schemes = [(config.CELL_SCHEME, config.CELL_SIZE, config.CELL_GEOHASH_PRECISION)]
+    schemes += [("grid", size, config.CELL_GEOHASH_PRECISION) for size in args.grid]
+    schemes += [("geohash", config.CELL_SIZE, precision) for precision in args.geohash]
+    asyncio.run(report(schemes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# weather/client.py
+import asyncio
+import time
+import aiohttp
+from typing import TypedDict
+import codec
+import config
+from metrics import owm_duration, owm_responses
+from tracing import traced
+
+class OWMMain(TypedDict, total=False):
+    temp: float
+    temp_min: float
+    temp_max: float
+    humidity: int
+
+class OWMWind(TypedDict, total=False):
+    speed: float
+    deg: int
+
+class OWMWeather(TypedDict, total=False):
+    description: str
+
+class OWMEntry(TypedDict):
+    dt: int
+    main: OWMMain
+    wind: OWMWind
+    weather: list[OWMWeather]
+
+OWMForecast = TypedDict("OWMForecast", {"list": list[OWMEntry], "city": dict}, total=False)
+
+class ForecastError(Exception):
+    # status None — ответа нет: ошибка сети или таймаут
+    def __init__(self, status: int | None, reason: str | None = None):
+        super().__init__(reason or f"OpenWeatherMap ответил статусом {status}")
+        self.status = status
+
+class OWMClient:
+    """Общий HTTP-клиент OpenWeatherMap с пулом keep-alive соединений.
+
+    Сессия создаётся в on_startup диспетчера и закрывается при остановке.
+    """
+
+    def __init__(self, api_key: str, url: str):
+        self.api_key = api_key
+        self.url = url
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=config.HTTP_POOL_SIZE,
+            limit_per_host=config.HTTP_POOL_SIZE,
+            ttl_dns_cache=config.HTTP_DNS_TTL,
+            keepalive_timeout=config.HTTP_KEEPALIVE
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=config.HTTP_TIMEOUT,
+            connect=config.HTTP_CONNECT_TIMEOUT
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @traced("owm.request")
+    async def forecast(self, lat: float, lon: float, units: str, lang: str) -> OWMForecast:
+        if self._session is None:
+            raise RuntimeError("OWMClient не запущен: вызовите start() при старте диспетчера")
+        params = {"lat": lat, "lon": lon, "appid": self.api_key, "units": units, "lang": lang}
+        started = time.perf_counter()
+        try:
+            async with self._session.get(self.url, params=params) as response:
+                owm_responses.inc(str(response.status))
+                if response.status != 200:
+                    raise ForecastError(response.status)
+                return codec.loads(await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            owm_responses.inc(type(e).__name__)
+            raise ForecastError(None, f"OpenWeatherMap недоступен: {e!r}") from e
+        finally:
+            owm_duration.observe(time.perf_counter() - started)
+
+owm_client = OWMClient(config.OWM_API, config.OWM_API_URL)
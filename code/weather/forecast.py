@@ -0,0 +1,218 @@
+# weather/forecast.py
+import asyncio
+import contextvars
+import logging
+from dataclasses import replace
+import time
+import codec
+import config
+from cache import TTLCache
+from tracing import span, traced
+from database.db import async_session
+from database.repository import ForecastCacheRepository
+from .cells import Cell, cell_of
+from .client import owm_client, OWMForecast, ForecastError
+from .models import Forecast, parse_forecast
+from .quota import QuotaGovernor, QuotaExhausted, Priority
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+UNITS = "metric"
+LANG = "ru"
+
+# Прогноз обновляется раз в несколько минут, поэтому повторные нажатия
+# обслуживаются из памяти без запроса к OpenWeatherMap
+forecast_cache: TTLCache[Forecast] = TTLCache(
+    ttl=config.FORECAST_CACHE_TTL,
+    maxsize=config.FORECAST_CACHE_SIZE
+)
+
+# Одновременные запросы одних и тех же координат ждут один общий запрос
+inflight = SingleFlight()
+
+# Сохранение в базу не задерживает ответ; ссылки на задачи держим до их завершения
+_pending_writes: set[asyncio.Task] = set()
+
+quota = QuotaGovernor(
+    rate_per_minute=config.OWM_RATE_PER_MINUTE,
+    burst=config.OWM_BURST,
+    daily_limit=config.OWM_DAILY_LIMIT
+)
+
+# Прогнозы хранятся по ячейкам (weather/cells.py): соседние точки
+# получают один прогноз, запрошенный для центра ячейки
+def cache_key(cell: Cell, units: str, lang: str) -> str:
+    return f"{cell.key},{units},{lang}"
+
+@traced("forecast.fetch")
+async def fetch_forecast(
+    lat: float,
+    lon: float,
+    units: str = UNITS,
+    lang: str = LANG,
+    priority: Priority = Priority.INTERACTIVE
+) -> Forecast:
+    cell = cell_of(lat, lon)
+    key = cache_key(cell, units, lang)
+    forecast = forecast_cache.get(key)
+    if forecast is not None:
+        return forecast
+    joined = key in inflight
+    load = inflight.do(key, lambda: _load_forecast(key, cell, units, lang, priority))
+    try:
+        if joined and priority == Priority.INTERACTIVE:
+            # Общий запрос мог начать prefetch или рассылка: в очереди лимита у него
+            # низкий приоритет и нет таймаута, поэтому нажатие ждёт не дольше
+            # OWM_QUEUE_TIMEOUT, как и собственный запрос
+            try:
+                return await asyncio.wait_for(load, config.OWM_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise QuotaExhausted("Превышено время ожидания общего запроса") from None
+        return await load
+    except QuotaExhausted:
+        # Лимит исчерпан: лучше показать устаревший прогноз, чем ошибку
+        forecast = forecast_cache.peek(key)
+        if forecast is None:
+            raise
+        return replace(forecast, stale=True)
+
+async def _load_forecast(
+    key: str,
+    cell: Cell,
+    units: str,
+    lang: str,
+    priority: Priority
+) -> Forecast:
+    # После перезапуска (или от другого воркера) прогноз мог остаться в базе
+    forecast = await _load_persisted(key)
+    if forecast is not None and forecast.age < forecast_cache.ttl:
+        return forecast
+    return await _fetch_upstream(key, cell, units, lang, priority)
+
+async def _fetch_upstream(
+    key: str,
+    cell: Cell,
+    units: str,
+    lang: str,
+    priority: Priority
+) -> Forecast:
+    timeout = config.OWM_QUEUE_TIMEOUT if priority == Priority.INTERACTIVE else None
+    with span("owm.quota"):
+        await quota.acquire(priority, timeout)
+    try:
+        data = await owm_client.forecast(cell.lat, cell.lon, units, lang)
+    except ForecastError as e:
+        if e.status == 429:
+            quota.drain()
+            raise QuotaExhausted("OpenWeatherMap ответил 429") from e
+        raise
+    with span("forecast.parse"):
+        forecast = parse_forecast(data, time.time())
+    forecast_cache.set(key, forecast, forecast.fetched_at)
+    if config.FORECAST_PERSIST:
+        # Пустой контекст: запись завершится после ответа и не должна попасть в его трассу
+        task = asyncio.create_task(_persist(key, data, forecast.fetched_at), context=contextvars.Context())
+        _pending_writes.add(task)
+        task.add_done_callback(_pending_writes.discard)
+    return forecast
+
+def expires_in(lat: float, lon: float, units: str = UNITS, lang: str = LANG) -> float:
+    """Сколько секунд осталось до устаревания прогноза в кэше (0, если его нет)."""
+    forecast = forecast_cache.peek(cache_key(cell_of(lat, lon), units, lang))
+    if forecast is None:
+        return 0
+    return max(forecast_cache.ttl - forecast.age, 0)
+
+async def refresh_forecast(
+    lat: float,
+    lon: float,
+    units: str = UNITS,
+    lang: str = LANG,
+    priority: Priority = Priority.BACKGROUND
+) -> Forecast:
+    """Запрашивает прогноз у OpenWeatherMap в обход кэша и обновляет его."""
+    cell = cell_of(lat, lon)
+    key = cache_key(cell, units, lang)
+    return await inflight.do(key, lambda: _fetch_upstream(key, cell, units, lang, priority))
+
+@traced("forecast.load_persisted")
+async def _load_persisted(key: str) -> Forecast | None:
+    if not config.FORECAST_PERSIST:
+        return None
+    cached = forecast_cache.peek(key)
+    # Без воркеров базу пишет только этот процесс: в памяти прогноз не старее
+    if cached is not None and not config.FORECAST_SHARED:
+        return None
+    async with async_session() as session:
+        row = await ForecastCacheRepository.get(session, key, cached.fetched_at if cached else 0)
+    if row is None:
+        return None
+    # Даже устаревшая запись пригодится как запасной вариант при исчерпании лимита
+    forecast = parse_forecast(codec.loads(row.payload), row.fetched_at)
+    forecast_cache.set(key, forecast, forecast.fetched_at)
+    return forecast
+
+@traced("forecast.persist")
+async def _persist(key: str, data: OWMForecast, fetched_at: float) -> None:
+    if not config.FORECAST_PERSIST:
+        return
+    try:
+        async with async_session() as session:
+            await ForecastCacheRepository.save(
+                session, key, codec.dumps(data), fetched_at
+            )
+    except Exception as e:
+        logger.warning("Не удалось сохранить прогноз %s: %r", key, e)
+
+async def flush_persisted() -> None:
+    """Дожидается сохранения прогнозов, запрошенных перед остановкой."""
+    await asyncio.gather(*_pending_writes, return_exceptions=True)
+
+async def preload_forecasts() -> int:
+    """Заполняет кэш свежими прогнозами из базы при старте."""
+    if not config.FORECAST_PERSIST:
+        return 0
+    async with async_session() as session:
+        rows = await ForecastCacheRepository.get_fresh(
+            session, time.time() - forecast_cache.ttl, forecast_cache.maxsize
+        )
+    # Самые свежие добавляем последними, чтобы LRU вытеснял старые
+    for row in reversed(rows):
+        forecast_cache.set(row.key, parse_forecast(codec.loads(row.payload), row.fetched_at), row.fetched_at)
+    return len(rows)
+
+async def sweep_forecasts() -> None:
+    """Периодически удаляет из базы прогнозы старше FORECAST_PERSIST_TTL."""
+    while True:
+        await asyncio.sleep(config.FORECAST_SWEEP_INTERVAL)
+        try:
+            async with async_session() as session:
+                removed = await ForecastCacheRepository.delete_expired(
+                    session, time.time() - config.FORECAST_PERSIST_TTL
+                )
+            if removed:
+                logger.info("Удалено устаревших прогнозов: %d", removed)
+        except Exception as e:
+            logger.warning("Ошибка очистки кэша прогнозов: %r", e)
+
+async def fetch_many(
+    coords: list[tuple[float, float]],
+    concurrency: int = config.COMPARE_CONCURRENCY,
+    timeout: float = config.COMPARE_PLACE_TIMEOUT
+) -> list[Forecast | BaseException]:
+    """Параллельно загружает прогнозы для нескольких точек.
+
+    Результаты идут в порядке coords; ошибка одной точки возвращается
+    на её месте как исключение и не прерывает остальные запросы.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(lat: float, lon: float) -> Forecast:
+        async with semaphore:
+            return await asyncio.wait_for(fetch_forecast(lat, lon), timeout)
+
+    return await asyncio.gather(
+        *(fetch_one(lat, lon) for lat, lon in coords),
+        return_exceptions=True
+    )
@@ -0,0 +1,80 @@
+# weather/models.py
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any
+from .client import OWMForecast
+
+
+class ForecastEntry:
+    """Один трёхчасовой отрезок прогноза, разобранный из ответа OWM."""
+
+    __slots__ = (
+        "dt", "date", "hour", "temp", "temp_min", "temp_max",
+        "humidity", "wind_speed", "wind_deg", "description"
+    )
+
+    def __init__(
+        self,
+        dt: int,
+        date: date,
+        hour: str,
+        temp: float | None,
+        temp_min: float | None,
+        temp_max: float | None,
+        humidity: int | None,
+        wind_speed: float | None,
+        wind_deg: int | None,
+        description: str
+    ):
+        self.dt = dt
+        self.date = date
+        self.hour = hour
+        self.temp = temp
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.humidity = humidity
+        self.wind_speed = wind_speed
+        self.wind_deg = wind_deg
+        self.description = description
+
+
+@dataclass(slots=True)
+class Forecast:
+    entries: tuple[ForecastEntry, ...]
+    fetched_at: float
+    stale: bool = False
+    # Записи в виде столбцов для weather/aggregate, заполняются при первой агрегации
+    columns: Any = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def by_date(self) -> dict[date, list[ForecastEntry]]:
+        days: dict[date, list[ForecastEntry]] = {}
+        for entry in self.entries:
+            days.setdefault(entry.date, []).append(entry)
+        return days
+
+
+def parse_forecast(data: OWMForecast, fetched_at: float) -> Forecast:
+    entries = []
+    for item in data.get("list", ()):
+        local = datetime.fromtimestamp(item["dt"])
+        main = item.get("main", {})
+        wind = item.get("wind", {})
+        weather = item.get("weather") or [{}]
+        entries.append(ForecastEntry(
+            dt=item["dt"],
+            date=local.date(),
+            hour=local.strftime("%H:%M"),
+            temp=main.get("temp"),
+            temp_min=main.get("temp_min"),
+            temp_max=main.get("temp_max"),
+            humidity=main.get("humidity"),
+            wind_speed=wind.get("speed"),
+            wind_deg=wind.get("deg"),
+            description=weather[0].get("description", "н/д").capitalize()
+        ))
+    return Forecast(tuple(entries), fetched_at)
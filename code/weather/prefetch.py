@@ -0,0 +1,79 @@
+# weather/prefetch.py
+import asyncio
+import logging
+import config
+from database.db import async_session
+from database.repository import PlaceRepository
+from .cells import cell_from_key
+from .forecast import expires_in, refresh_forecast, quota
+from .quota import Priority, QuotaExhausted
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Заранее обновляет прогнозы для самых популярных сохранённых мест.
+
+    Раз в interval секунд выбирает places_limit ячеек с наибольшим числом мест и
+    обновляет те, чей прогноз устареет в ближайшие lead секунд. За один
+    проход тратит не больше budget запросов и не трогает квоту, если
+    дневной расход превысил долю quota_share.
+    """
+
+    def __init__(self, interval: float, lead: float, places_limit: int, budget: int, quota_share: float):
+        self.interval = interval
+        self.lead = lead
+        self.places_limit = places_limit
+        self.budget = budget
+        self.quota_share = quota_share
+        self.refreshed = 0
+        self.failed = 0
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh_once()
+            except Exception as e:
+                logger.warning("Ошибка фонового обновления прогнозов: %r", e)
+            await asyncio.sleep(self.interval)
+
+    async def refresh_once(self) -> int:
+        async with async_session() as session:
+            popular = await PlaceRepository.get_popular(session, self.places_limit)
+
+        refreshed = 0
+        for key, _ in popular:
+            if refreshed >= self.budget or self._quota_reserved():
+                break
+            cell = cell_from_key(key)
+            if expires_in(cell.lat, cell.lon) > self.lead:
+                continue
+            try:
+                await refresh_forecast(cell.lat, cell.lon, priority=Priority.BACKGROUND)
+            except QuotaExhausted:
+                break
+            except Exception as e:
+                self.failed += 1
+                logger.debug("Не удалось обновить прогноз ячейки %s: %r", key, e)
+                continue
+            refreshed += 1
+
+        self.refreshed += refreshed
+        return refreshed
+
+    def _quota_reserved(self) -> bool:
+        # Оставляем остаток дневного бюджета для запросов пользователей
+        if quota.daily_limit is None:
+            return False
+        return quota.used_today >= quota.daily_limit * self.quota_share
+
+    def stats(self) -> dict:
+        return {"refreshed": self.refreshed, "failed": self.failed}
+
+prefetcher = Prefetcher(
+    interval=config.PREFETCH_INTERVAL,
+    lead=config.PREFETCH_LEAD,
+    places_limit=config.PREFETCH_PLACES,
+    budget=config.PREFETCH_BUDGET,
+    quota_share=config.PREFETCH_QUOTA_SHARE
+)
@@ -0,0 +1,136 @@
+# weather/quota.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timezone
+from enum import IntEnum
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # нажатия пользователей
+    BACKGROUND = 1   # фоновое обновление кэша
+    BULK = 2         # массовые рассылки
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+def _utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+class QuotaGovernor:
+    """Ограничитель исходящих запросов к OpenWeatherMap.
+
+    Token bucket задаёт поминутный темп (rate_per_minute, с запасом burst),
+    daily_limit — дневной бюджет (None — без ограничения). Ожидающие запросы обслуживаются
+    в порядке приоритета, внутри приоритета — в порядке поступления.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, daily_limit: int | None):
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute должен быть больше нуля, получено {rate_per_minute}")
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.daily_limit = daily_limit
+        self.granted = 0
+        self.rejected = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._day = _utc_today()
+        self._used_today = 0
+        self._queue: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: asyncio.Task | None = None
+
+    @property
+    def used_today(self) -> int:
+        self._roll_day()
+        return self._used_today
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE, timeout: float | None = None) -> None:
+        self._check_budget()
+        self._refill()
+        if not self._queue and self._tokens >= 1:
+            self._take()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise QuotaExhausted("Превышено время ожидания лимита запросов") from None
+
+    def share(self, parts: int) -> None:
+        # Лимиты тарифа общие для всех процессов: каждому достаётся своя доля
+        self.rate /= parts
+        self.burst = max(1, self.burst // parts)
+        if self.daily_limit is not None:
+            self.daily_limit //= parts
+        self._tokens = min(self._tokens, self.burst)
+
+    def drain(self) -> None:
+        # Сервер уже ответил 429: не тратим оставшиеся токены впустую
+        self._refill()
+        self._tokens = 0
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "tokens": round(self._tokens, 2),
+            "queued": len(self._queue),
+            "used_today": self.used_today,
+            "daily_limit": self.daily_limit,
+            "granted": self.granted,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self) -> None:
+        while self._queue:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            try:
+                self._check_budget()
+            except QuotaExhausted as e:
+                future.set_exception(e)
+                continue
+            self._take()
+            future.set_result(None)
+
+    def _check_budget(self) -> None:
+        self._roll_day()
+        if self.daily_limit is not None and self._used_today >= self.daily_limit:
+            self.rejected += 1
+            raise QuotaExhausted("Дневной лимит запросов к OpenWeatherMap исчерпан")
+
+    def _take(self) -> None:
+        self._tokens -= 1
+        self._used_today += 1
+        self.granted += 1
+        if self._used_today == self.daily_limit:
+            logger.warning("Дневной лимит запросов к OpenWeatherMap исчерпан (%d)", self.daily_limit)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _roll_day(self) -> None:
+        today = _utc_today()
+        if today != self._day:
+            self._day = today
+            self._used_today = 0
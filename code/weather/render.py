@@ -0,0 +1,136 @@
+# weather/render.py
+from datetime import date, datetime
+from typing import Sequence
+from database.models import PlaceInfo
+from .aggregate import DailySummary, daily_summaries, hourly_slots
+from .models import Forecast
+
+# Тексты сообщений с прогнозом. Функции не зависят от aiogram,
+# поэтому их можно вызывать из бенчмарков (bench/render_bench.py)
+
+WIND_DIRECTIONS = ["⬇️ С", "↘️ СВ", "➡️ В", "↗️ ЮВ", "⬆️ Ю", "↖️ ЮЗ", "⬅️ З", "↙️ СЗ"]
+
+def get_wind_direction(deg: float | None) -> str:
+    return WIND_DIRECTIONS[round(deg / 45) % 8] if deg else "н/д"
+
+def get_day_name(date: date) -> str:
+    days = ["Понедельник", "Вторник", "Среда", "Четверг",
+           "Пятница", "Суббота", "Воскресенье"]
+    return days[date.weekday()]
+
+def na(value) -> str:
+    return "н/д" if value is None else value
+
+def get_stale_note(forecast: Forecast) -> str:
+    if not forecast.stale:
+        return ""
+    fetched = datetime.fromtimestamp(forecast.fetched_at)
+    return f"⚠️ Лимит запросов исчерпан, данные от {fetched.strftime('%H:%M')} ({round(forecast.age / 60)} мин назад)\n\n"
+
+def render_current(forecast: Forecast) -> str | None:
+    if not forecast.entries:
+        return None
+
+    current = forecast.entries[0]
+    return (
+        f"{get_stale_note(forecast)}"
+        f"🌡 Сейчас: {na(current.temp)}°C\n"
+        f"💧 Влажность: {na(current.humidity)}%\n"
+        f"🌪 Ветер: {na(current.wind_speed)} м/с ({get_wind_direction(current.wind_deg)})\n"
+        f"☁️ {current.description}"
+    )
+
+def render_daily(forecast: Forecast, days: int, summaries: Sequence[DailySummary] | None = None) -> str:
+    """summaries — готовые сводки прогноза, если их посчитали пачкой для многих прогнозов."""
+    if days > 1:
+        if summaries is None:
+            summaries = daily_summaries([forecast])[0]
+        return get_stale_note(forecast) + "\n\n".join(render_summary(summary) for summary in summaries[:days])
+
+    forecasts = forecast.by_date()
+    response = []
+    for day in sorted(forecasts.keys())[:days]:
+        response.append(f"📅 {get_day_name(day)} ({day}):")
+        for entry in forecasts[day]:
+            response.append(
+                f"⏰ {entry.hour}:\n"
+                f"  🌡 {na(entry.temp)}°C\n"
+                f"  💧 {na(entry.humidity)}%\n"
+                f"  🌪 {na(entry.wind_speed)} м/с ({get_wind_direction(entry.wind_deg)})\n"
+                f"  ☁️ {entry.description}"
+            )
+
+    return get_stale_note(forecast) + "\n\n".join(response)
+
+def render_summary(summary: DailySummary) -> str:
+    humidity = None if summary.humidity_mean is None else round(summary.humidity_mean)
+    direction = "н/д" if summary.wind_sector is None else WIND_DIRECTIONS[summary.wind_sector]
+    return (
+        f"📅 {get_day_name(summary.date)} ({summary.date}):\n"
+        f"  🌡 {na(summary.temp_min)}°C...{na(summary.temp_max)}°C\n"
+        f"  💧 Влажность: ~{na(humidity)}%\n"
+        f"  🌪 Ветер: до {na(summary.wind_max)} м/с ({direction})\n"
+        f"  ☁️ {na(summary.description)}"
+    )
+
+def render_day_line(summary: DailySummary) -> str:
+    mean = None if summary.temp_mean is None else round(summary.temp_mean, 1)
+    direction = "н/д" if summary.wind_sector is None else WIND_DIRECTIONS[summary.wind_sector]
+    return (
+        f"🌡 {na(summary.temp_min)}...{na(summary.temp_max)}°C (~{na(mean)}°C) | "
+        f"🌪 до {na(summary.wind_max)} м/с ({direction}) | ☁️ {na(summary.description)}"
+    )
+
+def render_comparison(
+    places: Sequence[PlaceInfo],
+    forecasts: Sequence[Forecast | BaseException],
+    days: set[date],
+    hours: set[str]
+) -> str:
+    """Сравнение мест; forecasts[i] — прогноз для places[i] или ошибка его получения."""
+    failed_places = []
+    stale_places = []
+    loaded: list[Forecast] = []
+    names: list[str] = []
+
+    for place, forecast in zip(places, forecasts):
+        if isinstance(forecast, BaseException):
+            failed_places.append(place.name)
+            continue
+        if forecast.stale:
+            stale_places.append(f"{place.name} ({round(forecast.age / 60)} мин назад)")
+        loaded.append(forecast)
+        names.append(place.name)
+
+    summaries = [
+        {summary.date: summary for summary in place_summaries}
+        for place_summaries in daily_summaries(loaded)
+    ]
+    slots = hourly_slots(loaded, days, hours)
+
+    result = []
+    if failed_places:
+        result.append(f"⚠️ Нет данных для: {', '.join(failed_places)}\n")
+    if stale_places:
+        result.append(f"⚠️ Устаревшие данные для: {', '.join(stale_places)}\n")
+    for day in sorted(days):
+        result.append(f"📅 {get_day_name(day)} ({day.strftime('%d.%m')}):")
+        # Сводка за весь день, не только за выбранные часы
+        for index, name in enumerate(names):
+            summary = summaries[index].get(day)
+            if summary is not None:
+                result.append(f"  🌍 {name}: {render_day_line(summary)}")
+
+        for time, entries in slots.get(day, {}).items():
+            result.append(f"\n⏰ {time}:")
+
+            for index, weather in entries:
+                result.append(
+                    f"  🌍 {names[index]}:\n"
+                    f"    🌡 {na(weather.temp)}°C | 💧 {na(weather.humidity)}%\n"
+                    f"    🌪 {na(weather.wind_speed)} м/с | ☁️ {weather.description}"
+                )
+
+        result.append("\n" + "─"*30)
+
+    return "\n".join(result)
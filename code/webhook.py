@@ -0,0 +1,45 @@
+# webhook.py
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def build_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    if not config.WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook задайте WEBHOOK_SECRET")
+
+    app = web.Application()
+    # handle_in_background: Telegram сразу получает 200, а апдейт
+    # обрабатывается отдельной задачей без очереди перед обработчиком
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET,
+        handle_in_background=True
+    ).register(app, path=config.WEBHOOK_PATH)
+    # Запуск и остановка диспетчера привязываются к жизненному циклу приложения
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher) -> None:
+    url = config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH
+    await bot.set_webhook(
+        url,
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types()
+    )
+    logger.info("Webhook установлен: %s", url)
+
+
+def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    if not config.WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook задайте WEBHOOK_URL")
+    dp.startup.register(set_webhook)
+    app = build_app(dp, bot)
+    # run_app останавливает приложение по SIGINT/SIGTERM, вызывая shutdown диспетчера
+    web.run_app(app, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
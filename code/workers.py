@@ -0,0 +1,254 @@
+# workers.py
+"""Многопроцессный режим: python workers.py
+
+Супервизор получает обновления (getUpdates или webhook по BOT_MODE) и раздаёт
+их WORKERS процессам по id пользователя, так что все обновления одного
+пользователя обрабатывает один воркер в порядке поступления. Состояние
+диалогов и кэш прогнозов общие (STATE_BACKEND sqlite/redis, таблица
+forecast_cache). Упавший воркер перезапускается; обновления, которые
+он не успел забрать из очереди, теряются.
+"""
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import signal
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from typing import Any
+import aiohttp
+from aiohttp import web
+import codec
+import config
+
+logger = logging.getLogger(__name__)
+
+# Типы обновлений, в которых отправитель лежит в поле from
+_USER_UPDATES = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "business_message", "edited_business_message",
+)
+
+
+def user_of(update: dict[str, Any]) -> int | None:
+    for kind in _USER_UPDATES:
+        event = update.get(kind)
+        if event is not None:
+            sender = event.get("from")
+            return sender["id"] if sender else None
+    return None
+
+
+def shard_of(update: dict[str, Any], count: int) -> int:
+    user_id = user_of(update)
+    return user_id % count if user_id is not None else update["update_id"] % count
+
+
+# --- Воркер ---
+
+def worker_main(index: int, count: int, updates: Queue) -> None:
+    # Остановкой по Ctrl+C управляет супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s %(name)s: %(message)s")
+    # Состояние должно быть видно всем воркерам и переживать перезапуск
+    if config.STATE_BACKEND == "memory":
+        config.STATE_BACKEND = "sqlite"
+    config.RUN_BACKGROUND_JOBS = index == 0
+    # Свежий прогноз в базе мог сохранить другой воркер
+    config.FORECAST_SHARED = True
+    # Каждый воркер отдаёт свои метрики на своём порту
+    config.METRICS_PORT += index
+    asyncio.run(_run_worker(count, updates))
+
+
+async def _run_worker(count: int, updates: Queue) -> None:
+    from main import bot, dp
+    from outbound import outbound
+    from weather.forecast import quota
+    quota.share(count)
+    outbound.share(count)
+
+    workflow_data = {"dispatcher": dp, "bot": bot, "bots": [bot], **dp.workflow_data}
+    await dp.emit_startup(**workflow_data)
+
+    loop = asyncio.get_running_loop()
+    # Последняя задача каждого пользователя: следующая ждёт её завершения
+    tails: dict[int, asyncio.Task] = {}
+
+    async def process(previous: asyncio.Task | None, update: dict[str, Any]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.get("update_id"))
+
+    def forget(user_id: int, task: asyncio.Task) -> None:
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    pending: set[asyncio.Task] = set()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            user_id = user_of(update)
+            task = asyncio.create_task(process(tails.get(user_id), update))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            if user_id is not None:
+                tails[user_id] = task
+                task.add_done_callback(lambda t, u=user_id: forget(u, t))
+        await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        await dp.emit_shutdown(**workflow_data)
+        await bot.session.close()
+
+
+# --- Супервизор ---
+
+class Supervisor:
+    def __init__(self, count: int):
+        self.count = count
+        self._context = multiprocessing.get_context("spawn")
+        self.queues: list[Queue] = [self._context.Queue() for _ in range(count)]
+        self.processes: list[BaseProcess | None] = [None] * count
+        self.restarts = 0
+        self._stopping = False
+
+    def dispatch(self, update: dict[str, Any]) -> None:
+        self.queues[shard_of(update, self.count)].put(update)
+
+    def start_worker(self, index: int) -> None:
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self.count, self.queues[index]),
+            name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info("Воркер %d запущен (pid %d)", index, process.pid)
+
+    async def monitor(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(config.WORKER_MONITOR_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not self._stopping and process is not None and not process.is_alive():
+                    logger.error("Воркер %d завершился с кодом %s, перезапуск", index, process.exitcode)
+                    self.restarts += 1
+                    # Процесс мог погибнуть внутри queue.get, удерживая блокировку
+                    # чтения очереди: новому воркеру нужна новая очередь
+                    self.queues[index] = self._context.Queue()
+                    self.start_worker(index)
+
+    async def poll(self, bot, allowed_updates: list[str]) -> None:
+        # Сырые обновления без разбора в объекты aiogram: супервизору нужен только id пользователя
+        await bot.delete_webhook()
+        url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+        timeout = aiohttp.ClientTimeout(total=config.POLLING_TIMEOUT + 10)
+        offset = None
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while not self._stopping:
+                params = {"timeout": config.POLLING_TIMEOUT, "allowed_updates": allowed_updates}
+                if offset is not None:
+                    params["offset"] = offset
+                try:
+                    async with session.post(url, json=params) as response:
+                        payload = await response.json(loads=codec.loads)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("Ошибка getUpdates: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+                if not payload.get("ok"):
+                    retry_after = payload.get("parameters", {}).get("retry_after", 1)
+                    logger.warning("getUpdates: %s", payload.get("description"))
+                    await asyncio.sleep(retry_after)
+                    continue
+                for update in payload["result"]:
+                    offset = update["update_id"] + 1
+                    self.dispatch(update)
+
+    def build_webhook_app(self) -> web.Application:
+        if not config.WEBHOOK_SECRET:
+            raise RuntimeError("Для режима webhook задайте WEBHOOK_SECRET")
+        secret = config.WEBHOOK_SECRET.encode()
+
+        async def handle(request: web.Request) -> web.Response:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+            if not hmac.compare_digest(token, secret):
+                return web.Response(status=401)
+            self.dispatch(await request.json(loads=codec.loads))
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, handle)
+        return app
+
+    async def serve_webhook(self, bot, dp) -> None:
+        if not config.WEBHOOK_URL:
+            raise RuntimeError("Для режима webhook задайте WEBHOOK_URL")
+        from webhook import set_webhook
+        runner = web.AppRunner(self.build_webhook_app())
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+            await set_webhook(bot, dp)
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    def stop(self) -> None:
+        self._stopping = True
+        for queue in self.queues:
+            queue.put(None)
+            queue.close()
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(timeout=30)
+            if process.is_alive():
+                logger.warning("Воркер %d не остановился, завершаем принудительно", index)
+                process.terminate()
+                process.join()
+
+    async def run(self) -> None:
+        from main import bot, dp
+        from database.db import engine
+        from database.migrations import migrate
+        # Схему обновляет супервизор до запуска воркеров
+        await migrate(engine)
+        await engine.dispose()
+
+        for index in range(self.count):
+            self.start_worker(index)
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        if config.BOT_MODE == "webhook":
+            source = self.serve_webhook(bot, dp)
+        else:
+            source = self.poll(bot, dp.resolve_used_update_types())
+        tasks = [asyncio.create_task(self.monitor()), asyncio.create_task(source)]
+        stopped = asyncio.create_task(stop.wait())
+        try:
+            await asyncio.wait([*tasks, stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (*tasks, stopped):
+                task.cancel()
+            await asyncio.gather(*tasks, stopped, return_exceptions=True)
+            await bot.session.close()
+            await loop.run_in_executor(None, self.stop)
+        # Падение источника обновлений (например, без WEBHOOK_URL) — ошибка запуска
+        for task in tasks:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[supervisor] %(levelname)s %(name)s: %(message)s")
+    asyncio.run(Supervisor(config.WORKERS).run())